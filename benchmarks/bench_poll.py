@@ -0,0 +1,287 @@
+"""Benchmark the fronius_inverter poll cycle against simulated Datamanagers.
+
+Starts one simulated Solar API (or Modbus) server per site in a separate process, sets
+the platform up through async_setup_platform on a Home Assistant core
+instance and then drives the coordinators through many poll cycles
+back to back. Reports:
+
+* per tick latency percentiles (all coordinators polled together)
+* CPU time per tick and per sensor update, spent in this process only
+  (requests, parsing, publishing and the sensor updates together)
+* net allocated blocks and peak traced memory per tick (with --trace-alloc)
+* state writes per simulated minute
+
+Everything runs locally, e.g.:
+
+    python benchmarks/bench_poll.py --model gen24 --sites 4 --devices 3 --ticks 500
+    python benchmarks/bench_poll.py --transport modbus --sites 4 --devices 3 --ticks 500
+
+Requires homeassistant and aiohttp to be installed.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'custom_components'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import modbus_simulator  # noqa: E402
+import simulator  # noqa: E402
+
+
+def _free_port():
+    """Return a free local TCP port."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _serve_site(args, site, port):
+    """Run one simulated Datamanager, in a child process."""
+    if args.transport == 'modbus':
+        modbus_simulator.serve(modbus_simulator.simulator_from_arguments(args, site), '127.0.0.1', port)
+        return
+    simulator.serve(simulator.simulator_from_arguments(args, site), '127.0.0.1', port)
+
+
+async def _wait_for_port(port, timeout=10):
+    """Wait until a simulator accepts connections."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection('127.0.0.1', port)
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.05)
+        else:
+            writer.close()
+            return
+
+
+async def async_create_hass(config_dir):
+    """Return a Home Assistant core instance for the benchmark."""
+    from homeassistant.core import HomeAssistant
+
+    try:
+        hass = HomeAssistant(config_dir)
+    except TypeError:
+        # releases before 2024.4 take no arguments
+        hass = HomeAssistant()
+        hass.config.config_dir = config_dir
+    hass.config.latitude = -33.86
+    hass.config.longitude = 151.21
+    return hass
+
+
+def percentile(samples, fraction):
+    """Return the given percentile of a list of samples."""
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def build_config(args, ports):
+    """Return the platform configuration for the simulated sites."""
+    inverters = []
+    for site, port in enumerate(ports):
+        for device_id in range(1, args.devices + 1):
+            inverter = {
+                'ip_address': '127.0.0.1:{}'.format(port),
+                'name': 'Site {} Inverter {}'.format(site, device_id),
+                'device_id': str(device_id),
+                # the powerflow and meter belong to the Datamanager
+                'powerflow': args.powerflow and device_id == 1,
+                'smartmeter': args.smartmeter and device_id == 1,
+            }
+            if args.transport == 'modbus':
+                # the Modbus simulator does not serve the powerflow
+                inverter.update(ip_address='127.0.0.1', modbus_port=port, powerflow=False)
+            inverters.append(inverter)
+    config = {
+        'platform': 'fronius_inverter',
+        'name': 'Bench',
+        'model': args.model,
+        'inverters': inverters,
+        'batch': args.batch,
+        'aggregate': args.batch,
+        'scan_interval': args.scan_interval,
+        'units': 'kWh',
+        'transport': args.transport,
+    }
+    if args.sample_interval:
+        config['sample_interval'] = args.sample_interval
+    return config
+
+
+async def async_run(args, ports):
+    """Set the platform up and drive it through the poll cycles."""
+    from fronius_inverter import sensor
+    from homeassistant.helpers import restore_state
+
+    for port in ports:
+        await _wait_for_port(port)
+
+    config_dir = tempfile.mkdtemp(prefix='fronius_bench_')
+    hass = await async_create_hass(config_dir)
+    config = sensor.PLATFORM_SCHEMA(build_config(args, ports))
+    if hasattr(restore_state, 'async_load'):
+        # releases from 2023.3 load the restored states explicitly
+        await restore_state.async_load(hass)
+
+    writes = 0
+    pending = []
+
+    def schedule_update(entity, force_refresh=False):
+        # stands in for the state machine write a real entity platform does
+        nonlocal writes
+        writes += 1
+        pending.append(asyncio.ensure_future(entity.async_update()))
+
+    sensor.FroniusSensor.async_schedule_update_ha_state = schedule_update
+
+    entities = []
+
+    def add_entities(new_entities, update_before_add=False):
+        entities.extend(new_entities)
+
+    await sensor.async_setup_platform(hass, config, add_entities)
+    for index, entity in enumerate(entities):
+        entity.hass = hass
+        entity.entity_id = 'sensor.bench_{}'.format(index)
+        await entity.async_added_to_hass()
+
+    coordinators = hass.data[sensor.DOMAIN][sensor.DATA_COORDINATORS]
+    for coordinator in coordinators:
+        # the benchmark drives the ticks itself
+        coordinator.async_stop()
+
+    # settle setup and the first poll before measuring
+    await asyncio.gather(*(coordinator.async_refresh() for coordinator in coordinators))
+    await asyncio.gather(*pending)
+    pending.clear()
+    writes = 0
+
+    tick_latency = []
+    tick_cpu_ns = []
+    tick_blocks = []
+    tick_peak = []
+    if args.trace_alloc:
+        tracemalloc.start()
+
+    ticks_per_publish = round(args.scan_interval / args.sample_interval) if args.sample_interval else 1
+    for tick in range(args.ticks):
+        # ticks run back to back, so expire the results that coordinators
+        # share within one interval, and let a scan_interval pass for them
+        for coordinator in coordinators:
+            coordinator.expire(publish=tick % ticks_per_publish == 0)
+        blocks = sys.getallocatedblocks()
+        if args.trace_alloc:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        cpu_start = time.process_time_ns()
+        await asyncio.gather(*(coordinator.async_refresh() for coordinator in coordinators))
+        await asyncio.gather(*pending)
+        tick_cpu_ns.append(time.process_time_ns() - cpu_start)
+        tick_latency.append(time.perf_counter() - start)
+        pending.clear()
+        tick_blocks.append(sys.getallocatedblocks() - blocks)
+        if args.trace_alloc:
+            tick_peak.append(tracemalloc.get_traced_memory()[1])
+
+    if args.trace_alloc:
+        tracemalloc.stop()
+
+    session = hass.data[sensor.DOMAIN].get(sensor.DATA_SESSION)
+    if session is not None:
+        await session.close()
+    for client in hass.data[sensor.DOMAIN].get(sensor.DATA_MODBUS_CLIENTS, {}).values():
+        client.close()
+
+    simulated_minutes = args.ticks * (args.sample_interval or args.scan_interval) / 60
+    report = {
+        'model': args.model,
+        'transport': args.transport,
+        'sites': args.sites,
+        'devices_per_site': args.devices,
+        'batch': args.batch,
+        'sample_interval': args.sample_interval,
+        'sensors': len(entities),
+        'ticks': args.ticks,
+        'tick_latency_ms': {
+            'p50': percentile(tick_latency, 0.50) * 1000,
+            'p90': percentile(tick_latency, 0.90) * 1000,
+            'p99': percentile(tick_latency, 0.99) * 1000,
+            'max': max(tick_latency) * 1000,
+        },
+        'cpu_us_per_tick': statistics.mean(tick_cpu_ns) / 1000,
+        'cpu_us_per_sensor_update': sum(tick_cpu_ns) / writes / 1000 if writes else 0.0,
+        'sensor_updates': writes,
+        'net_blocks_per_tick': statistics.mean(tick_blocks),
+        'state_writes_per_minute': writes / simulated_minutes if simulated_minutes else 0.0,
+    }
+    if tick_peak:
+        report['peak_traced_kib_per_tick'] = statistics.mean(tick_peak) / 1024
+    return report
+
+
+def print_report(report):
+    """Print a benchmark report for humans."""
+    latency = report['tick_latency_ms']
+    print("{} sensors, {} sites x {} inverters ({} over {}), {} ticks".format(
+        report['sensors'], report['sites'], report['devices_per_site'], report['model'], report['transport'], report['ticks']))
+    print("tick latency ms   p50 {p50:8.2f}  p90 {p90:8.2f}  p99 {p99:8.2f}  max {max:8.2f}".format(**latency))
+    print("cpu per tick      {:8.1f} us".format(report['cpu_us_per_tick']))
+    print("cpu per update    {:8.1f} us over {} updates".format(report['cpu_us_per_sensor_update'], report['sensor_updates']))
+    print("net blocks/tick   {:8.1f}".format(report['net_blocks_per_tick']))
+    if 'peak_traced_kib_per_tick' in report:
+        print("peak KiB/tick     {:8.1f}".format(report['peak_traced_kib_per_tick']))
+    print("state writes/min  {:8.1f}".format(report['state_writes_per_minute']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    modbus_simulator.add_arguments(parser)
+    parser.add_argument('--transport', choices=('http', 'modbus'), default='http', help="transport to poll over")
+    parser.add_argument('--sites', type=int, default=1, help="simulated Datamanagers")
+    parser.add_argument('--ticks', type=int, default=200, help="poll cycles to run")
+    parser.add_argument('--scan-interval', type=int, default=10, help="simulated scan interval in seconds")
+    parser.add_argument('--sample-interval', type=int, default=None,
+                        help="simulated sample interval in seconds, each tick is then one sample")
+    parser.add_argument('--batch', action='store_true', help="use System scope batching")
+    parser.add_argument('--no-powerflow', dest='powerflow', action='store_false')
+    parser.add_argument('--no-smartmeter', dest='smartmeter', action='store_false')
+    parser.add_argument('--trace-alloc', action='store_true', help="trace memory, slows the run down")
+    parser.add_argument('--json', dest='json_output', help="also write the report to this file")
+    args = parser.parse_args()
+
+    ports = [_free_port() for _ in range(args.sites)]
+    servers = [multiprocessing.Process(target=_serve_site, args=(args, site, port), daemon=True)
+               for site, port in enumerate(ports)]
+    for server in servers:
+        server.start()
+    try:
+        report = asyncio.run(async_run(args, ports))
+    finally:
+        for server in servers:
+            server.terminate()
+
+    print_report(report)
+    if args.json_output:
+        with open(args.json_output, 'w') as output:
+            json.dump(report, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
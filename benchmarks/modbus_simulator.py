@@ -0,0 +1,270 @@
+"""Simulated Fronius Datamanager answering SunSpec Modbus TCP requests.
+
+Serves the inverter and meter models read by the fronius_inverter sensor
+over Modbus, encoded from the recorded Symo responses in fixtures/, for any
+number of inverters (unit ids 1, 2, ...) and meters (unit ids 240, 241, ...).
+Values wander like in the Solar API simulator, and latency, jitter and errors
+can be injected the same way.
+
+Run standalone with:
+
+    python benchmarks/modbus_simulator.py --devices 4 --port 5020
+"""
+import argparse
+import asyncio
+import copy
+import random
+import struct
+from collections import Counter
+
+import simulator
+
+READ_HOLDING_REGISTERS = 0x03
+ILLEGAL_FUNCTION = 0x01
+ILLEGAL_DATA_ADDRESS = 0x02
+SLAVE_DEVICE_FAILURE = 0x04
+GATEWAY_TARGET_FAILED = 0x0B
+
+MODEL_ADDRESS = 40069
+SITE_ENERGY_ADDRESS = 501
+METER_UNIT_ID_OFFSET = 240
+
+NOT_IMPLEMENTED = 0xFFFF
+SF_NOT_IMPLEMENTED = 0x8000
+# SunSpec operating state while producing
+STATE_MPPT = 4
+
+
+def _sf(value):
+    """Encode a scale factor."""
+    return value & 0xFFFF
+
+
+def _u16(value, scale=0):
+    """Encode a value with the given scale factor, or not implemented."""
+    if value is None:
+        return NOT_IMPLEMENTED
+    return int(round(value * 10 ** -scale)) & 0xFFFF
+
+
+def _u32(value):
+    """Encode an acc32 counter as two registers."""
+    value = int(value or 0) & 0xFFFFFFFF
+    return [value >> 16, value & 0xFFFF]
+
+
+def _u64(value):
+    """Encode a uint64 counter as four registers."""
+    if value is None:
+        return [0xFFFF] * 4
+    value = int(value)
+    return [(value >> shift) & 0xFFFF for shift in (48, 32, 16, 0)]
+
+
+def _f32(value):
+    """Encode a float32 value as two registers."""
+    return list(struct.unpack('>HH', struct.pack('>f', float('nan') if value is None else value)))
+
+
+def _value(data, key):
+    """Return the value of a Solar API data item."""
+    item = data.get(key)
+    return item.get('Value') if isinstance(item, dict) else item
+
+
+def encode_inverter(data, use_float=False):
+    """Return the inverter model registers (ID, L and the model data)."""
+    if use_float:
+        registers = [0] * 60
+        floats = {0: 'IAC', 14: 'UAC', 20: 'PAC', 22: 'FAC', 30: 'TOTAL_ENERGY', 32: 'IDC', 34: 'UDC'}
+        for offset, key in floats.items():
+            registers[offset:offset + 2] = _f32(_value(data, key))
+        registers[46] = STATE_MPPT
+        return [113, 60] + registers
+
+    registers = [NOT_IMPLEMENTED] * 50
+    registers[0] = _u16(_value(data, 'IAC'), -2)
+    registers[4] = _sf(-2)
+    registers[8] = _u16(_value(data, 'UAC'), -1)
+    registers[11] = _sf(-1)
+    registers[12] = int(_value(data, 'PAC') or 0) & 0xFFFF
+    registers[13] = _sf(0)
+    registers[14] = _u16(_value(data, 'FAC'), -2)
+    registers[15] = _sf(-2)
+    registers[22:24] = _u32(_value(data, 'TOTAL_ENERGY'))
+    registers[24] = _sf(0)
+    registers[25] = _u16(_value(data, 'IDC'), -2)
+    registers[26] = _sf(-2)
+    registers[27] = _u16(_value(data, 'UDC'), -1)
+    registers[28] = _sf(-1)
+    registers[36] = STATE_MPPT
+    return [103, 50] + registers
+
+
+def encode_site(inverters):
+    """Return the Fronius site energy registers summing all inverters."""
+    registers = []
+    for key in ('DAY_ENERGY', 'YEAR_ENERGY', 'TOTAL_ENERGY'):
+        values = [_value(data, key) for data in inverters]
+        registers.extend(_u64(None if None in values else sum(values)))
+    return registers
+
+
+def encode_meter(data, use_float=False):
+    """Return the meter model registers (ID, L and the model data)."""
+    if use_float:
+        registers = [0] * 124
+        floats = {
+            2: 'Current_AC_Phase_1', 4: 'Current_AC_Phase_2', 6: 'Current_AC_Phase_3',
+            10: 'Voltage_AC_Phase_1', 12: 'Voltage_AC_Phase_2', 14: 'Voltage_AC_Phase_3', 26: 'PowerReal_P_Sum',
+            58: 'EnergyReal_WAC_Sum_Produced', 66: 'EnergyReal_WAC_Sum_Consumed',
+        }
+        for offset, key in floats.items():
+            registers[offset:offset + 2] = _f32(data.get(key))
+        return [213, 124] + registers
+
+    registers = [NOT_IMPLEMENTED] * 105
+    registers[0] = _u16(data.get('Current_AC_Sum'), -2)
+    registers[1] = _u16(data.get('Current_AC_Phase_1'), -2)
+    registers[2] = _u16(data.get('Current_AC_Phase_2'), -2)
+    registers[3] = _u16(data.get('Current_AC_Phase_3'), -2)
+    registers[4] = _sf(-2)
+    registers[6] = _u16(data.get('Voltage_AC_Phase_1'), -1)
+    registers[7] = _u16(data.get('Voltage_AC_Phase_2'), -1)
+    registers[8] = _u16(data.get('Voltage_AC_Phase_3'), -1)
+    registers[13] = _sf(-1)
+    power = data.get('PowerReal_P_Sum')
+    registers[16] = 0x8000 if power is None else int(round(power)) & 0xFFFF
+    registers[20] = _sf(0)
+    registers[36:38] = _u32(data.get('EnergyReal_WAC_Sum_Produced'))
+    registers[44:46] = _u32(data.get('EnergyReal_WAC_Sum_Consumed'))
+    registers[52] = _sf(0)
+    return [203, 105] + registers
+
+
+class ModbusSimulator:
+    """Serve simulated SunSpec registers for one Datamanager."""
+
+    def __init__(self, devices=1, meters=1, latency=0.0, jitter=0.0, error_rate=0.0,
+                 error_types=('status', 'disconnect'), stall=15.0, use_float=False, seed=None):
+        """Initialize the simulator, see simulator.FroniusSimulator for the arguments."""
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_types = tuple(error_types)
+        self.stall = stall
+        self.use_float = use_float
+        self.requests = Counter()
+        self.errors = Counter()
+        self._rng = random.Random(seed)
+
+        inverter = simulator.load_fixture('symo', 'inverter')['Body']['Data']
+        self._inverters = {device_id: copy.deepcopy(inverter) for device_id in range(1, devices + 1)}
+        meter = simulator.load_fixture('symo', 'meter')['Body']['Data']
+        self._meters = {METER_UNIT_ID_OFFSET + meter_id: copy.deepcopy(meter) for meter_id in range(meters)}
+
+    def read(self, unit, address, count):
+        """Return the registers read from a unit, or a Modbus exception code."""
+        if unit in self._inverters:
+            if address == SITE_ENERGY_ADDRESS:
+                registers = encode_site(list(self._inverters.values()))
+                start = SITE_ENERGY_ADDRESS
+            else:
+                simulator._wander(self._inverters[unit], self._rng)
+                registers = encode_inverter(self._inverters[unit], self.use_float)
+                start = MODEL_ADDRESS
+        elif unit in self._meters:
+            simulator._wander(self._meters[unit], self._rng)
+            registers = encode_meter(self._meters[unit], self.use_float)
+            start = MODEL_ADDRESS
+        else:
+            return GATEWAY_TARGET_FAILED
+
+        # anything past the model reads as the end marker of the model list
+        registers = registers + [NOT_IMPLEMENTED] * max(0, address + count - start - len(registers))
+        if address < start:
+            return ILLEGAL_DATA_ADDRESS
+        return registers[address - start:address - start + count]
+
+    async def handle(self, reader, writer):
+        """Answer the requests of one connection."""
+        try:
+            while True:
+                header = await reader.readexactly(7)
+                transaction, protocol, length, unit = struct.unpack('>HHHB', header)
+                pdu = await reader.readexactly(length - 1)
+                self.requests[unit] += 1
+
+                delay = self.latency + (self._rng.uniform(-self.jitter, self.jitter) if self.jitter else 0)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+                result = ILLEGAL_FUNCTION
+                if pdu[0] == READ_HOLDING_REGISTERS:
+                    address, count = struct.unpack('>HH', pdu[1:5])
+                    result = self.read(unit, address, count)
+
+                if self.error_rate and self._rng.random() < self.error_rate:
+                    error = self._rng.choice(self.error_types)
+                    self.errors[error] += 1
+                    if error == 'stall':
+                        await asyncio.sleep(self.stall)
+                    elif error == 'disconnect':
+                        return
+                    result = SLAVE_DEVICE_FAILURE
+
+                if isinstance(result, int):
+                    response = struct.pack('>BB', pdu[0] | 0x80, result)
+                else:
+                    response = struct.pack('>BB{}H'.format(len(result)), pdu[0], 2 * len(result), *result)
+                writer.write(struct.pack('>HHHB', transaction, protocol, len(response) + 1, unit) + response)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+def add_arguments(parser):
+    """Add the simulator options to an argument parser."""
+    simulator.add_arguments(parser)
+    parser.add_argument('--float', dest='use_float', action='store_true', help="serve the float SunSpec models")
+
+
+def simulator_from_arguments(args, seed_offset=0):
+    """Return a simulator configured from parsed arguments."""
+    error_types = [error for error in args.error_types.split(',') if error]
+    for error in error_types:
+        if error not in simulator.ERROR_TYPES:
+            raise SystemExit("Unknown error type: {}".format(error))
+    seed = None if args.seed is None else args.seed + seed_offset
+    return ModbusSimulator(args.devices, args.meters, args.latency, args.jitter, args.error_rate,
+                           error_types, use_float=getattr(args, 'use_float', False), seed=seed)
+
+
+def serve(modbus_simulator, host, port):
+    """Serve a simulator until interrupted."""
+
+    async def run():
+        server = await asyncio.start_server(modbus_simulator.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_arguments(parser)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5020)
+    args = parser.parse_args()
+    print("Simulating a Datamanager on modbus://{}:{}".format(args.host, args.port))
+    serve(simulator_from_arguments(args), args.host, args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+"""Simulated Fronius Solar API server replaying recorded responses.
+
+Serves the realtime inverter, powerflow and meter endpoints requested by the
+fronius_inverter sensor from the recorded Symo and GEN24 responses in
+fixtures/, for any number of inverters and meters behind one Datamanager.
+Power values wander and energy counters grow between requests so that state
+changes look like a real site. Latency, jitter and errors can be injected.
+
+Run standalone with:
+
+    python benchmarks/simulator.py --model gen24 --devices 4 --port 8080
+"""
+import argparse
+import asyncio
+import copy
+import json
+import os
+import random
+from collections import Counter
+
+from aiohttp import web
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+INVERTER_PATH = '/solar_api/v1/GetInverterRealtimeData.cgi'
+POWERFLOW_PATH = '/solar_api/v1/GetPowerFlowRealtimeData.fcgi'
+METER_PATH = '/solar_api/v1/GetMeterRealtimeData.cgi'
+
+# the only values a Scope=System inverter request returns
+SYSTEM_KEYS = ('PAC', 'DAY_ENERGY', 'YEAR_ENERGY', 'TOTAL_ENERGY')
+
+ERROR_TYPES = ('status', 'disconnect', 'stall')
+
+
+def load_fixture(model, kind):
+    """Return a recorded response of the given model and endpoint."""
+    with open(os.path.join(FIXTURES, '{}_{}.json'.format(model, kind))) as fixture:
+        return json.load(fixture)
+
+
+def _is_energy(key):
+    """Return True for counters that only ever grow."""
+    return 'ENERGY' in key.upper() or key.startswith('E_')
+
+
+def _wander(data, rng):
+    """Move power readings and advance energy counters in place."""
+    for key, value in data.items():
+        if isinstance(value, dict):
+            if 'Value' in value and isinstance(value['Value'], (int, float)):
+                value['Value'] = _step(key, value['Value'], rng)
+            continue
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            data[key] = _step(key, value, rng)
+
+
+def _step(key, value, rng):
+    """Return the next reading of one value."""
+    if _is_energy(key):
+        return round(value + rng.uniform(0, 5), 1)
+    if 'VOLTAGE' in key.upper() or key in ('UAC', 'UDC', 'FAC') or 'Frequency' in key:
+        return round(value * rng.uniform(0.998, 1.002), 2)
+    return round(value * rng.uniform(0.9, 1.1), 2)
+
+
+class FroniusSimulator:
+    """Serve simulated Solar API responses for one Datamanager."""
+
+    def __init__(self, model='symo', devices=1, meters=1, latency=0.0, jitter=0.0,
+                 error_rate=0.0, error_types=('status', 'disconnect'), stall=15.0, seed=None):
+        """Initialize the simulator.
+
+        latency and jitter are in seconds, error_rate is the probability of
+        answering a request with one of error_types, and a 'stall' error holds
+        the request for stall seconds.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_types = tuple(error_types)
+        self.stall = stall
+        self.requests = Counter()
+        self.errors = Counter()
+        self._rng = random.Random(seed)
+
+        inverter = load_fixture(model, 'inverter')
+        self._inverters = {str(device_id): copy.deepcopy(inverter) for device_id in range(1, devices + 1)}
+        meter = load_fixture(model, 'meter')
+        self._meters = {str(meter_id): copy.deepcopy(meter) for meter_id in range(meters)}
+        self._powerflow = load_fixture(model, 'powerflow')
+
+    def create_app(self):
+        """Return the aiohttp application serving the Solar API."""
+        app = web.Application()
+        app.router.add_get(INVERTER_PATH, self._handle_inverter)
+        app.router.add_get(POWERFLOW_PATH, self._handle_powerflow)
+        app.router.add_get(METER_PATH, self._handle_meter)
+        return app
+
+    async def _delay(self, request):
+        """Wait for the simulated latency, returning a response if the request fails."""
+        self.requests[request.path] += 1
+        delay = self.latency + (self._rng.uniform(-self.jitter, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        if self.error_rate and self._rng.random() < self.error_rate:
+            error = self._rng.choice(self.error_types)
+            self.errors[error] += 1
+            if error == 'stall':
+                await asyncio.sleep(self.stall)
+            elif error == 'disconnect':
+                request.transport.close()
+            return web.Response(status=503, text='Service unavailable')
+        return None
+
+    @staticmethod
+    def _respond(document):
+        """Return a JSON response the way the Datamanager sends it."""
+        return web.Response(body=json.dumps(document).encode(), content_type='application/json')
+
+    @staticmethod
+    def _not_found(template, arguments):
+        """Return the answer to a request for a device that does not exist."""
+        document = {
+            'Body': {'Data': {}},
+            'Head': dict(template['Head'], RequestArguments=arguments,
+                         Status={'Code': 8, 'Reason': 'Device not found', 'UserMessage': ''}),
+        }
+        return FroniusSimulator._respond(document)
+
+    async def _handle_inverter(self, request):
+        error = await self._delay(request)
+        if error is not None:
+            return error
+
+        arguments = dict(request.query)
+        template = next(iter(self._inverters.values()))
+        if arguments.get('Scope') == 'System':
+            data = {}
+            for device_id, inverter in self._inverters.items():
+                _wander(inverter['Body']['Data'], self._rng)
+                for key in SYSTEM_KEYS:
+                    item = inverter['Body']['Data'][key]
+                    data.setdefault(key, {'Unit': item['Unit'], 'Values': {}})['Values'][device_id] = item['Value']
+            return self._respond({'Body': {'Data': data}, 'Head': dict(template['Head'], RequestArguments=arguments)})
+
+        inverter = self._inverters.get(arguments.get('DeviceId', '1'))
+        if inverter is None:
+            return self._not_found(template, arguments)
+        _wander(inverter['Body']['Data'], self._rng)
+        return self._respond(dict(inverter, Head=dict(inverter['Head'], RequestArguments=arguments)))
+
+    async def _handle_powerflow(self, request):
+        error = await self._delay(request)
+        if error is not None:
+            return error
+
+        _wander(self._powerflow['Body']['Data']['Site'], self._rng)
+        return self._respond(self._powerflow)
+
+    async def _handle_meter(self, request):
+        error = await self._delay(request)
+        if error is not None:
+            return error
+
+        arguments = dict(request.query)
+        template = next(iter(self._meters.values()), None) or load_fixture('symo', 'meter')
+        if arguments.get('Scope') == 'System':
+            data = {}
+            for meter_id, meter in self._meters.items():
+                _wander(meter['Body']['Data'], self._rng)
+                data[meter_id] = meter['Body']['Data']
+            return self._respond({'Body': {'Data': data}, 'Head': dict(template['Head'], RequestArguments=arguments)})
+
+        meter = self._meters.get(arguments.get('DeviceId', '0'))
+        if meter is None:
+            return self._not_found(template, arguments)
+        _wander(meter['Body']['Data'], self._rng)
+        return self._respond(dict(meter, Head=dict(meter['Head'], RequestArguments=arguments)))
+
+
+def add_arguments(parser):
+    """Add the simulator options to an argument parser."""
+    parser.add_argument('--model', choices=('symo', 'gen24'), default='symo', help="recorded responses to replay")
+    parser.add_argument('--devices', type=int, default=1, help="inverters behind each Datamanager")
+    parser.add_argument('--meters', type=int, default=1, help="meters behind each Datamanager")
+    parser.add_argument('--latency', type=float, default=0.05, help="response latency in seconds")
+    parser.add_argument('--jitter', type=float, default=0.02, help="latency jitter in seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="probability of a failed request")
+    parser.add_argument('--error-types', default='status,disconnect',
+                        help="comma separated failures to inject from: {}".format(', '.join(ERROR_TYPES)))
+    parser.add_argument('--seed', type=int, default=None, help="random seed for repeatable runs")
+
+
+def simulator_from_arguments(args, seed_offset=0):
+    """Return a simulator configured from parsed arguments."""
+    error_types = [error for error in args.error_types.split(',') if error]
+    for error in error_types:
+        if error not in ERROR_TYPES:
+            raise SystemExit("Unknown error type: {}".format(error))
+    seed = None if args.seed is None else args.seed + seed_offset
+    return FroniusSimulator(args.model, args.devices, args.meters, args.latency, args.jitter,
+                            args.error_rate, error_types, seed=seed)
+
+
+def serve(simulator, host, port):
+    """Serve a simulator until interrupted."""
+    web.run_app(simulator.create_app(), host=host, port=port, print=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_arguments(parser)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    args = parser.parse_args()
+    print("Simulating a {} Datamanager on http://{}:{}".format(args.model, args.host, args.port))
+    serve(simulator_from_arguments(args), args.host, args.port)
+
+
+if __name__ == '__main__':
+    main()
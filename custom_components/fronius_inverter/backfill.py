@@ -0,0 +1,294 @@
+"""Backfill long-term statistics from the Solar API archive.
+
+Hours missing from the statistics of the inverter sensors while Home
+Assistant was down, or recorded from stale states while the Datamanager could
+not be reached, are read from GetArchiveData.cgi one bounded chunk at a time.
+Each chunk is parsed as a stream (with ijson if it is installed) and
+aggregated into hourly statistics rows as the values arrive, so memory use
+does not grow with the length of the gap.
+"""
+import asyncio
+import inspect
+import logging
+from datetime import timedelta
+
+import aiohttp
+
+from homeassistant.util import dt as dt_util
+
+try:
+    # ijson parses the archive as it streams in
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+_ARCHIVE_URL = 'http://{}/solar_api/v1/GetArchiveData.cgi'
+_LOGGER = logging.getLogger(__name__)
+
+# the archive returns at most 16 days, smaller chunks bound the response size
+CHUNK = timedelta(days=1)
+ARCHIVE_TIMEOUT = 60
+
+# Key: ['channel', 'statistic', 'reset']
+# mean channels are sampled values, sum channels the energy of each interval.
+# Only sensors with a state class have statistics to continue.
+ARCHIVE_CHANNELS = {
+    'ac_power': ['PowerReal_PAC_Sum', 'mean', None],
+    'day_energy': ['EnergyReal_WAC_Sum_Produced', 'sum', 'day'],
+    'year_energy': ['EnergyReal_WAC_Sum_Produced', 'sum', 'year'],
+    'total_energy': ['EnergyReal_WAC_Sum_Produced', 'sum', None],
+}
+
+
+def _period(hour, reset):
+    """Return the local day or year an hour belongs to, for counters that reset."""
+    if reset is None:
+        return None
+    local = dt_util.as_local(hour)
+    return local.date() if reset == 'day' else local.year
+
+
+class HourlyStatistics:
+    """Aggregate the archive values of one sensor into hourly statistics rows.
+
+    Values must arrive in time order. Only the hour being aggregated and the
+    rows of the current chunk are held. Energy rows continue the state and
+    sum of the last recorded row.
+    """
+
+    __slots__ = ('statistic_id', 'unit', 'statistic', 'reset', 'divisor', 'last_start',
+                 '_state', '_sum', '_period', '_hour', '_total', '_count', '_min', '_max', '_rows')
+
+    def __init__(self, statistic_id, unit, statistic, reset, divisor, last_start, state, total):
+        """Initialize the aggregation after the last recorded row."""
+        self.statistic_id = statistic_id
+        self.unit = unit
+        self.statistic = statistic
+        self.reset = reset
+        self.divisor = divisor
+        self.last_start = last_start
+        self._state = state or 0
+        self._sum = total or 0
+        self._period = _period(last_start, reset)
+        self._hour = None
+        self._total = 0
+        self._count = 0
+        self._min = None
+        self._max = None
+        self._rows = []
+
+    @property
+    def metadata(self):
+        """Return the statistics metadata of the sensor."""
+        return {
+            'has_mean': self.statistic == 'mean',
+            'has_sum': self.statistic == 'sum',
+            'name': None,
+            'source': 'recorder',
+            'statistic_id': self.statistic_id,
+            'unit_of_measurement': self.unit,
+        }
+
+    def add(self, when, value):
+        """Add one archive value."""
+        hour = when.replace(minute=0, second=0, microsecond=0)
+        if hour <= self.last_start:
+            # already recorded
+            return
+        if hour != self._hour:
+            self._finish()
+            self._hour = hour
+        value = value / self.divisor
+        self._total += value
+        self._count += 1
+        if self._min is None or value < self._min:
+            self._min = value
+        if self._max is None or value > self._max:
+            self._max = value
+
+    def _finish(self):
+        """Turn the hour being aggregated into a row."""
+        if self._hour is None:
+            return
+        if self.statistic == 'mean':
+            self._rows.append({
+                'start': self._hour,
+                'mean': self._total / self._count,
+                'min': self._min,
+                'max': self._max,
+            })
+        else:
+            period = _period(self._hour, self.reset)
+            if period != self._period:
+                # the day or year counter started over
+                self._state = 0
+                self._period = period
+            self._state += self._total
+            self._sum += self._total
+            self._rows.append({'start': self._hour, 'state': self._state, 'sum': self._sum})
+        self._hour = None
+        self._total = 0
+        self._count = 0
+        self._min = None
+        self._max = None
+
+    def flush(self):
+        """Return the rows completed so far and forget them."""
+        self._finish()
+        rows = self._rows
+        self._rows = []
+        return rows
+
+
+def _device_start(value, default):
+    """Return the Start of a device in an archive response, in UTC."""
+    start = dt_util.parse_datetime(value) if isinstance(value, str) else None
+    if start is None:
+        return default
+    return dt_util.as_utc(start)
+
+
+async def _archive_values(response, start):
+    """Yield (channel, time, value) from an archive response.
+
+    Value offsets count in seconds from the Start of their device, which the
+    Datamanager aligns to its own local day rather than the requested start.
+    """
+    if ijson is None:
+        # a chunk is small enough to decode at once
+        data = json_loads(await response.read())
+        for device in data['Body']['Data'].values():
+            device_start = _device_start(device.get('Start'), start)
+            for channel, item in device.get('Data', {}).items():
+                for offset, value in item.get('Values', {}).items():
+                    if value is not None:
+                        yield channel, device_start + timedelta(seconds=int(offset)), value
+        return
+
+    # prefixes look like Body.Data.inverter/1.Data.<channel>.Values.<offset>,
+    # the keys are sorted so values arrive before the Start of their device
+    # and are held back until it is known
+    starts = {}
+    held = {}
+    async for prefix, event, value in ijson.parse_async(response.content, use_float=True):
+        parts = prefix.split('.')
+        if len(parts) < 4 or parts[0] != 'Body' or parts[1] != 'Data':
+            continue
+        device = parts[2]
+        if len(parts) == 4 and parts[3] == 'Start' and event == 'string':
+            starts[device] = _device_start(value, start)
+            for channel, offset, number in held.pop(device, ()):
+                yield channel, starts[device] + timedelta(seconds=offset), number
+        elif event == 'number' and len(parts) == 7 and parts[3] == 'Data' and parts[5] == 'Values':
+            if device in starts:
+                yield parts[4], starts[device] + timedelta(seconds=int(parts[6])), value
+            else:
+                held.setdefault(device, []).append((parts[4], int(parts[6]), value))
+    for values in held.values():
+        # no Start, count from the requested start
+        for channel, offset, number in values:
+            yield channel, start + timedelta(seconds=offset), number
+
+
+async def _async_fetch_chunk(session, ip_address, device_id, by_channel, start, end):
+    """Stream the archive of one chunk into the aggregations of its channels."""
+    params = [
+        ('Scope', 'Device'),
+        ('DeviceClass', 'Inverter'),
+        ('DeviceId', device_id),
+        ('StartDate', start.strftime('%Y-%m-%dT%H:%M:%SZ')),
+        # the end date is inclusive
+        ('EndDate', (end - timedelta(seconds=1)).strftime('%Y-%m-%dT%H:%M:%SZ')),
+    ]
+    params.extend(('Channel', channel) for channel in by_channel)
+    _LOGGER.debug("Requesting archive of %s from %s to %s", ip_address, start, end)
+    async with session.get(_ARCHIVE_URL.format(ip_address), params=params, timeout=ARCHIVE_TIMEOUT) as response:
+        if response.status != 200:
+            raise ValueError("HTTP status {}".format(response.status))
+        async for channel, when, value in _archive_values(response, start):
+            if when < start or when >= end:
+                continue
+            for statistics in by_channel.get(channel, ()):
+                statistics.add(when, value)
+
+
+async def async_backfill(hass, session, ip_address, device_id, targets, max_window, since=None):
+    """Import the hours missing since the last statistics of the given sensors.
+
+    targets are (statistic_id, sensor_type, unit, divisor) tuples, where
+    divisor converts archive values to the unit of the sensor. With since,
+    the hours from since on are imported again instead, continuing the
+    statistics of the hour before. Sensors without statistics to continue
+    are skipped. Returns the number of rows imported.
+    """
+    try:
+        from homeassistant.components.recorder import get_instance
+        from homeassistant.components.recorder.statistics import (
+            async_import_statistics, get_last_statistics, statistics_during_period)
+    except ImportError:
+        _LOGGER.error("Backfill needs a recorder supporting statistics import")
+        return 0
+    if 'types' not in inspect.signature(get_last_statistics).parameters:
+        # releases before 2023.3 cannot select the statistics types
+        _LOGGER.error("Backfill needs Home Assistant 2023.3 or later")
+        return 0
+
+    end = dt_util.utcnow().replace(minute=0, second=0, microsecond=0)
+    before = None
+    if since is not None:
+        before = since.replace(minute=0, second=0, microsecond=0)
+    aggregations = []
+    for statistic_id, sensor_type, unit, divisor in targets:
+        if before is None:
+            last = await get_instance(hass).async_add_executor_job(
+                get_last_statistics, hass, 1, statistic_id, True, {'state', 'sum'})
+        else:
+            last = await get_instance(hass).async_add_executor_job(
+                statistics_during_period, hass, before - timedelta(hours=1), before, {statistic_id}, 'hour', None, {'state', 'sum'})
+        if not last.get(statistic_id):
+            _LOGGER.debug("No statistics to continue for %s", statistic_id)
+            continue
+        row = last[statistic_id][-1]
+        last_start = row['start']
+        if not hasattr(last_start, 'tzinfo'):
+            # timestamps since 2023.3
+            last_start = dt_util.utc_from_timestamp(last_start)
+        channel, statistic, reset = ARCHIVE_CHANNELS[sensor_type]
+        aggregations.append((channel, HourlyStatistics(
+            statistic_id, unit, statistic, reset, divisor, last_start, row.get('state'), row.get('sum'))))
+
+    if not aggregations:
+        return 0
+    start = max(min(statistics.last_start for _, statistics in aggregations) + timedelta(hours=1), end - max_window)
+    if start >= end:
+        return 0
+
+    by_channel = {}
+    for channel, statistics in aggregations:
+        by_channel.setdefault(channel, []).append(statistics)
+
+    _LOGGER.info("Backfilling statistics of %s device %s from %s", ip_address, device_id, start)
+    imported = 0
+    chunk_start = start
+    while chunk_start < end:
+        chunk_end = min(chunk_start + CHUNK, end)
+        try:
+            await _async_fetch_chunk(session, ip_address, device_id, by_channel, chunk_start, chunk_end)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError) as error:
+            # later rows would not continue the sums, so stop here
+            _LOGGER.warning("Backfill of %s stopped at %s: %s", ip_address, chunk_start, error)
+            break
+        for _, statistics in aggregations:
+            rows = statistics.flush()
+            if rows:
+                async_import_statistics(hass, statistics.metadata, rows)
+                imported += len(rows)
+        chunk_start = chunk_end
+
+    _LOGGER.info("Backfilled %s statistics rows of %s device %s", imported, ip_address, device_id)
+    return imported
@@ -0,0 +1,288 @@
+"""SunSpec Modbus TCP transport for Fronius inverters and meters.
+
+Reads the same values as the Solar API from the SunSpec registers of the
+Datamanager, with one contiguous block read per model over one persistent
+connection per Datamanager. The decoded values are keyed like the Solar API
+JSON so that they feed the same extractors.
+
+Modbus must be enabled on the Datamanager (Communication > Modbus TCP).
+Both the 'int + SF' and 'float' SunSpec model types are supported.
+"""
+import asyncio
+import logging
+import math
+import struct
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_PORT = 502
+DEFAULT_TIMEOUT = 5
+
+READ_HOLDING_REGISTERS = 0x03
+# unit id of the first meter, the next meters follow
+METER_UNIT_ID_OFFSET = 240
+
+# the inverter or meter model follows the common model at register 40070
+MODEL_ADDRESS = 40069
+# blocks covering everything read from the int + SF and float models
+INVERTER_BLOCK_LENGTH = 50
+METER_BLOCK_LENGTH = 70
+# Fronius site registers F_Site_Energy_Day, _Year and _Total (uint64)
+SITE_ENERGY_ADDRESS = 501
+SITE_ENERGY_LENGTH = 12
+# Solar API keys only available for the whole site
+SITE_ENERGY_KEYS = ('DAY_ENERGY', 'YEAR_ENERGY')
+
+INVERTER_INT_MODELS = (101, 102, 103)
+INVERTER_FLOAT_MODELS = (111, 112, 113)
+METER_INT_MODELS = (201, 202, 203, 204)
+METER_FLOAT_MODELS = (211, 212, 213, 214)
+
+# Solar API key: (value offset, scale factor offset) in the int + SF model
+INVERTER_INT_REGISTERS = {
+    'IAC': (0, 4),
+    'UAC': (8, 11),
+    'PAC': (12, 13),
+    'FAC': (14, 15),
+    'IDC': (25, 26),
+    'UDC': (27, 28),
+}
+INVERTER_INT_SIGNED = ('PAC',)
+INVERTER_INT_ENERGY = (22, 24)
+INVERTER_INT_STATUS = 36
+
+# Solar API key: value offset in the float model
+INVERTER_FLOAT_REGISTERS = {
+    'IAC': 0,
+    'UAC': 14,
+    'PAC': 20,
+    'FAC': 22,
+    'TOTAL_ENERGY': 30,
+    'IDC': 32,
+    'UDC': 34,
+}
+INVERTER_FLOAT_STATUS = 46
+
+# SunSpec operating state (St): Solar API status code
+SUNSPEC_STATUS_CODES = {
+    1: 8,   # off
+    2: 8,   # sleeping
+    3: 0,   # starting
+    4: 7,   # MPPT
+    5: 7,   # throttled
+    6: 8,   # shutting down
+    7: 10,  # fault
+    8: 8,   # standby
+}
+
+METER_INT_REGISTERS = {
+    'Current_AC_Phase_1': (1, 4),
+    'Current_AC_Phase_2': (2, 4),
+    'Current_AC_Phase_3': (3, 4),
+    'Voltage_AC_Phase_1': (6, 13),
+    'Voltage_AC_Phase_2': (7, 13),
+    'Voltage_AC_Phase_3': (8, 13),
+    # positive when importing from the grid, like the Solar API
+    'PowerReal_P_Sum': (16, 20),
+}
+METER_INT_SIGNED = ('PowerReal_P_Sum',)
+# acc32 energy counters: (offset, scale factor offset)
+METER_INT_ENERGY = {
+    'EnergyReal_WAC_Sum_Produced': (36, 52),
+    'EnergyReal_WAC_Sum_Consumed': (44, 52),
+}
+
+METER_FLOAT_REGISTERS = {
+    'Current_AC_Phase_1': 2,
+    'Current_AC_Phase_2': 4,
+    'Current_AC_Phase_3': 6,
+    'Voltage_AC_Phase_1': 10,
+    'Voltage_AC_Phase_2': 12,
+    'Voltage_AC_Phase_3': 14,
+    'PowerReal_P_Sum': 26,
+    'EnergyReal_WAC_Sum_Produced': 58,
+    'EnergyReal_WAC_Sum_Consumed': 66,
+}
+
+# the gen24 reports meter values under different Solar API keys
+METER_GEN24_KEYS = {
+    'Current_AC_Phase_1': 'ACBRIDGE_CURRENT_ACTIVE_MEAN_01_F32',
+    'Current_AC_Phase_2': 'ACBRIDGE_CURRENT_ACTIVE_MEAN_02_F32',
+    'Current_AC_Phase_3': 'ACBRIDGE_CURRENT_ACTIVE_MEAN_03_F32',
+    'Voltage_AC_Phase_1': 'SMARTMETER_VOLTAGE_01_F64',
+    'Voltage_AC_Phase_2': 'SMARTMETER_VOLTAGE_02_F64',
+    'Voltage_AC_Phase_3': 'SMARTMETER_VOLTAGE_03_F64',
+    'PowerReal_P_Sum': 'SMARTMETER_POWERACTIVE_MEAN_SUM_F64',
+    'EnergyReal_WAC_Sum_Consumed': 'SMARTMETER_ENERGYACTIVE_CONSUMED_SUM_F64',
+    'EnergyReal_WAC_Sum_Produced': 'SMARTMETER_ENERGYACTIVE_PRODUCED_SUM_F64',
+}
+
+UINT16_NOT_IMPLEMENTED = 0xFFFF
+INT16_NOT_IMPLEMENTED = 0x8000
+UINT64_NOT_IMPLEMENTED = 0xFFFFFFFFFFFFFFFF
+
+
+class ModbusTcpClient:
+    """Minimal Modbus TCP client keeping one connection open.
+
+    Requests are serialized over the connection, which is reopened on the
+    next request after any transport error. Connection problems raise
+    ConnectionError, timeouts asyncio.TimeoutError and invalid or exception
+    responses ValueError.
+    """
+
+    def __init__(self, host, port=DEFAULT_PORT, timeout=DEFAULT_TIMEOUT):
+        """Initialize the client."""
+        self._host = host
+        self._port = port
+        self._timeout = timeout
+        self._reader = None
+        self._writer = None
+        self._transaction = 0
+        self._lock = asyncio.Lock()
+
+    @property
+    def address(self):
+        """Return host:port of the server."""
+        return '{}:{}'.format(self._host, self._port)
+
+    async def _connect(self, timeout):
+        """Open the connection."""
+        _LOGGER.debug("Connecting to Modbus server %s", self.address)
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self._host, self._port), timeout)
+
+    def close(self):
+        """Close the connection."""
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = None
+        self._writer = None
+
+    async def read_holding_registers(self, unit, address, count, timeout=None):
+        """Return count registers starting at the 0-based address of unit."""
+        if timeout is None:
+            timeout = self._timeout
+        async with self._lock:
+            if self._writer is None:
+                try:
+                    await self._connect(timeout)
+                except OSError as error:
+                    raise ConnectionError(str(error)) from error
+
+            self._transaction = (self._transaction + 1) & 0xFFFF
+            request = struct.pack('>HHHBBHH', self._transaction, 0, 6, unit, READ_HOLDING_REGISTERS, address, count)
+            try:
+                self._writer.write(request)
+                await self._writer.drain()
+                header = await asyncio.wait_for(self._reader.readexactly(7), timeout)
+                transaction, protocol, length, _ = struct.unpack('>HHHB', header)
+                pdu = await asyncio.wait_for(self._reader.readexactly(length - 1), timeout)
+            except asyncio.TimeoutError:
+                self.close()
+                raise
+            except (OSError, asyncio.IncompleteReadError) as error:
+                self.close()
+                raise ConnectionError(str(error)) from error
+
+            if transaction != self._transaction or protocol != 0:
+                # out of step with the server, start over on a new connection
+                self.close()
+                raise ValueError("Unexpected Modbus transaction")
+            if pdu[0] & 0x80:
+                raise ValueError("Modbus exception {} reading {} from unit {}".format(pdu[1], address, unit))
+            if pdu[0] != READ_HOLDING_REGISTERS or pdu[1] != 2 * count:
+                raise ValueError("Invalid Modbus response")
+            return struct.unpack('>{}H'.format(count), pdu[2:2 + 2 * count])
+
+
+def _int16(value):
+    """Return a register as a signed value."""
+    return value - 0x10000 if value & 0x8000 else value
+
+
+def _scaled(registers, offset, sf_offset, signed=False):
+    """Return an int + SF value, or None if it is not implemented."""
+    raw = registers[offset]
+    scale = registers[sf_offset]
+    if scale == INT16_NOT_IMPLEMENTED:
+        return None
+    if signed:
+        if raw == INT16_NOT_IMPLEMENTED:
+            return None
+        raw = _int16(raw)
+    elif raw == UINT16_NOT_IMPLEMENTED:
+        return None
+    return raw * 10 ** _int16(scale)
+
+
+def _acc32(registers, offset, sf_offset):
+    """Return a scaled 32 bit accumulator."""
+    scale = registers[sf_offset]
+    if scale == INT16_NOT_IMPLEMENTED:
+        return None
+    return ((registers[offset] << 16) | registers[offset + 1]) * 10 ** _int16(scale)
+
+
+def _uint64(registers, offset):
+    """Return a 64 bit counter, or None if it is not implemented."""
+    value = 0
+    for register in registers[offset:offset + 4]:
+        value = (value << 16) | register
+    return None if value == UINT64_NOT_IMPLEMENTED else value
+
+
+def _float32(registers, offset):
+    """Return a float32 value, or None if it is not implemented."""
+    value = struct.unpack('>f', struct.pack('>HH', registers[offset], registers[offset + 1]))[0]
+    return None if math.isnan(value) else value
+
+
+def _round(value):
+    """Drop the float noise of scaled values."""
+    return None if value is None else round(value, 3)
+
+
+def decode_inverter(block, site=None):
+    """Decode an inverter model block and the site energy registers, if read.
+
+    Returns the values keyed like the Solar API, plus 'StatusCode' with the
+    operating state translated to a Solar API status code. The site energy
+    registers sum all inverters of the Datamanager.
+    """
+    model = block[0]
+    data = block[2:]
+    if model in INVERTER_INT_MODELS:
+        values = {key: _round(_scaled(data, offset, sf_offset, key in INVERTER_INT_SIGNED))
+                  for key, (offset, sf_offset) in INVERTER_INT_REGISTERS.items()}
+        values['TOTAL_ENERGY'] = _round(_acc32(data, *INVERTER_INT_ENERGY))
+        status = data[INVERTER_INT_STATUS]
+    elif model in INVERTER_FLOAT_MODELS:
+        values = {key: _round(_float32(data, offset)) for key, offset in INVERTER_FLOAT_REGISTERS.items()}
+        status = data[INVERTER_FLOAT_STATUS]
+    else:
+        raise ValueError("Unsupported SunSpec inverter model {}".format(model))
+
+    if site is not None:
+        values['DAY_ENERGY'] = _uint64(site, 0)
+        values['YEAR_ENERGY'] = _uint64(site, 4)
+    values['StatusCode'] = SUNSPEC_STATUS_CODES.get(status)
+    return values
+
+
+def decode_meter(block):
+    """Decode a meter model block, keyed like the Solar API of both models."""
+    model = block[0]
+    data = block[2:]
+    if model in METER_INT_MODELS:
+        values = {key: _round(_scaled(data, offset, sf_offset, key in METER_INT_SIGNED))
+                  for key, (offset, sf_offset) in METER_INT_REGISTERS.items()}
+        values.update((key, _round(_acc32(data, offset, sf_offset)))
+                      for key, (offset, sf_offset) in METER_INT_ENERGY.items())
+    elif model in METER_FLOAT_MODELS:
+        values = {key: _round(_float32(data, offset)) for key, offset in METER_FLOAT_REGISTERS.items()}
+    else:
+        raise ValueError("Unsupported SunSpec meter model {}".format(model))
+
+    values.update([(METER_GEN24_KEYS[key], value) for key, value in values.items()])
+    return values
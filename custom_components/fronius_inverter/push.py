@@ -0,0 +1,121 @@
+"""Receiver for the Fronius Datamanager Push Service."""
+import hmac
+import json
+import logging
+from base64 import b64decode
+from binascii import Error as BinasciiError
+from http import HTTPStatus
+
+from aiohttp import web
+
+from homeassistant.components.http import HomeAssistantView
+
+_LOGGER = logging.getLogger(__name__)
+
+PUSH_URL = '/api/fronius_inverter/push/{host}/{endpoint}'
+PUSH_DEVICE_URL = PUSH_URL + '/{device_id}'
+
+
+def _request_arguments(body):
+    """Return the request arguments the Datamanager reports in the head of a response, if any."""
+    try:
+        arguments = json.loads(body)['Head']['RequestArguments']
+    except (ValueError, KeyError, TypeError):
+        return {}
+    return arguments if isinstance(arguments, dict) else {}
+
+
+class FroniusPushView(HomeAssistantView):
+    """Accept realtime data pushed by a Datamanager over HTTP POST.
+
+    The Datamanager is configured to post to
+    /api/fronius_inverter/push/<ip_address>/<endpoint>[/<device_id>], where
+    endpoint is one of inverter, powerflow or smartmeter, with the push token
+    either as the password of the push service (HTTP basic auth) or as a token
+    query parameter. A token is only accepted for the Datamanagers of the
+    entry configuring it. The body is parsed by the fetchers polling that
+    endpoint of that Datamanager, for the device given in the URL or in the
+    head of the body.
+    """
+
+    url = PUSH_URL
+    extra_urls = [PUSH_DEVICE_URL]
+    name = 'api:fronius_inverter:push'
+    # the Datamanager cannot send Home Assistant credentials
+    requires_auth = False
+
+    def __init__(self, fetchers):
+        """Initialize the view with the fetcher registry."""
+        self._fetchers = fetchers
+        self._tokens = {}
+
+    def add_token(self, token, hosts):
+        """Accept pushes for the given hosts authenticated with token."""
+        for host in hosts:
+            self._tokens.setdefault(host, set()).add(token)
+
+    def _authenticated(self, request, host):
+        """Return True if the request carries a push token of host."""
+        tokens = self._tokens.get(host)
+        if not tokens:
+            return False
+
+        candidates = []
+        if 'token' in request.query:
+            candidates.append(request.query['token'])
+
+        authorization = request.headers.get('Authorization', '')
+        if authorization.lower().startswith('basic '):
+            try:
+                _, _, password = b64decode(authorization[6:]).decode().partition(':')
+            except (BinasciiError, UnicodeDecodeError):
+                return False
+            candidates.append(password)
+
+        return any(
+            hmac.compare_digest(candidate.encode(), token.encode())
+            for candidate in candidates
+            for token in tokens
+        )
+
+    async def post(self, request, host, endpoint, device_id=None):
+        """Ingest one push."""
+        if not self._authenticated(request, host):
+            _LOGGER.warning("Rejected push from %s: invalid token", request.remote)
+            return web.Response(status=HTTPStatus.UNAUTHORIZED)
+
+        body = await request.read()
+        arguments = _request_arguments(body)
+        scope = arguments.get('Scope')
+        if device_id is None and scope != 'System' and arguments.get('DeviceId') is not None:
+            device_id = str(arguments['DeviceId'])
+
+        fetchers = [
+            fetcher for fetcher in self._fetchers.values()
+            if fetcher.host == host and fetcher.endpoint.lower() == endpoint.lower()
+            and (scope is None or fetcher.scope in (None, scope))
+            # only Device scope fetchers read a single device
+            and (device_id is None or fetcher.scope != 'Device' or fetcher.device_id == device_id)
+        ]
+        if not fetchers:
+            _LOGGER.debug("Push for unknown endpoint %s/%s", host, endpoint)
+            return web.Response(status=HTTPStatus.NOT_FOUND)
+        if device_id is None and len({fetcher.device_id for fetcher in fetchers if fetcher.scope == 'Device'}) > 1:
+            # the values of one device must not be published for the others
+            _LOGGER.warning("Push for %s/%s does not name its device, add the device id to the push URL", host, endpoint)
+            return web.Response(status=HTTPStatus.BAD_REQUEST)
+
+        accepted = False
+        for fetcher in fetchers:
+            try:
+                fetcher.async_ingest(body)
+            except ValueError:
+                # e.g. a System scope push for a Device scope fetcher
+                _LOGGER.debug("Push for %s/%s does not match %s", host, endpoint, fetcher.url)
+            else:
+                accepted = True
+
+        if not accepted:
+            _LOGGER.warning("Invalid push received for %s/%s", host, endpoint)
+            return web.Response(status=HTTPStatus.BAD_REQUEST)
+        return web.Response(status=HTTPStatus.OK)
@@ -7,31 +7,75 @@ import voluptuous as vol
 import json
 import aiohttp
 import asyncio
+import random
+from array import array
+from bisect import bisect_left
+from collections import Counter, deque
+from math import ceil
+from time import monotonic, perf_counter
+from types import MappingProxyType
+from typing import NamedTuple
+
+try:
+    # orjson ships with Home Assistant and decodes several times faster
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
-from homeassistant.helpers.aiohttp_client import async_get_clientsession
 import homeassistant.helpers.config_validation as cv
 
 from homeassistant.const import (
-    CONF_MONITORED_CONDITIONS, CONF_NAME, CONF_SCAN_INTERVAL, ATTR_ATTRIBUTION, SUN_EVENT_SUNRISE, SUN_EVENT_SUNSET, STATE_UNAVAILABLE, DEVICE_CLASS_ENERGY, ENERGY_KILO_WATT_HOUR, ENERGY_WATT_HOUR, DEVICE_CLASS_POWER, POWER_KILO_WATT, POWER_WATT, DEVICE_CLASS_CURRENT, DEVICE_CLASS_VOLTAGE
+    CONF_MONITORED_CONDITIONS, CONF_NAME, CONF_SCAN_INTERVAL, ATTR_ATTRIBUTION, ATTR_ENTITY_ID, ATTR_UNIT_OF_MEASUREMENT, EVENT_HOMEASSISTANT_CLOSE, EVENT_HOMEASSISTANT_STARTED, SUN_EVENT_SUNRISE, SUN_EVENT_SUNSET, STATE_UNAVAILABLE, STATE_UNKNOWN, DEVICE_CLASS_ENERGY, ENERGY_KILO_WATT_HOUR, ENERGY_WATT_HOUR, DEVICE_CLASS_POWER, POWER_KILO_WATT, POWER_WATT, DEVICE_CLASS_CURRENT, DEVICE_CLASS_VOLTAGE
 )
 
 from homeassistant.components.sensor import (
     PLATFORM_SCHEMA, STATE_CLASS_MEASUREMENT, STATE_CLASS_TOTAL_INCREASING, SensorEntity,
 )
 
-from homeassistant.helpers.event import async_track_time_interval
+from homeassistant.helpers.event import async_call_later
 from homeassistant.helpers.entity import Entity
+
+try:
+    # new in HA 2021.12, older releases show diagnostics as regular sensors
+    from homeassistant.helpers.entity import EntityCategory
+except ImportError:
+    EntityCategory = None
+from homeassistant.helpers.restore_state import RestoreEntity
 from homeassistant.util.dt import utcnow as dt_utcnow, as_local
 from homeassistant.util import dt as dt_util
 from homeassistant.helpers.sun import get_astral_event_date
 
+from .backfill import ARCHIVE_CHANNELS, async_backfill
+from .modbus import (
+    DEFAULT_PORT as DEFAULT_MODBUS_PORT, INVERTER_BLOCK_LENGTH, METER_BLOCK_LENGTH, METER_UNIT_ID_OFFSET, MODEL_ADDRESS,
+    SITE_ENERGY_ADDRESS, SITE_ENERGY_KEYS, SITE_ENERGY_LENGTH, ModbusTcpClient, decode_inverter, decode_meter,
+)
+from .push import FroniusPushView
+
 _INVERTERRT_URL = 'http://{}/solar_api/v1/GetInverterRealtimeData.cgi?Scope={}&DeviceId={}&DataCollection=CommonInverterData'
 _POWERFLOW_URL = 'http://{}/solar_api/v1/GetPowerFlowRealtimeData.fcgi'
 _METER_URL = 'http://{}/solar_api/v1/GetMeterRealtimeData.cgi?Scope={}&DeviceId={}'
+_INVERTERRT_SYSTEM_URL = 'http://{}/solar_api/v1/GetInverterRealtimeData.cgi?Scope=System'
+_METER_SYSTEM_URL = 'http://{}/solar_api/v1/GetMeterRealtimeData.cgi?Scope=System'
 #_INVERTERRT_URL = 'http://{}{}?DeviceId={}&DataCollection=CommonInverterData'
 #_POWERFLOW_URL = 'http://{}PowerFlow'
 _LOGGER = logging.getLogger(__name__)
 
+DOMAIN = 'fronius_inverter'
+DATA_DAYLIGHT = 'daylight'
+DATA_FETCHERS = 'fetchers'
+DATA_SESSION = 'session'
+DATA_COORDINATORS = 'coordinators'
+DATA_DIAGNOSTICS = 'diagnostics'
+DATA_PUSH_VIEW = 'push_view'
+DATA_MODBUS_CLIENTS = 'modbus_clients'
+DATA_MODBUS_SITES = 'modbus_sites'
+DATA_BACKFILL = 'backfill'
+
+SERVICE_DUMP_DIAGNOSTICS = 'dump_diagnostics'
+SERVICE_BACKFILL = 'backfill'
+EVENT_DIAGNOSTICS = 'fronius_inverter_diagnostics'
+
 ATTRIBUTION = "Fronius Inverter Data"
 
 CONF_NAME = 'name'
@@ -45,13 +89,54 @@ CONF_POWERFLOW = 'powerflow'
 CONF_SMARTMETER = 'smartmeter'
 CONF_SMARTMETER_DEVICE_ID = 'smartmeter_device_id'
 CONF_ALWAYS_LOG = 'always_log'
+CONF_MAX_CONCURRENCY = 'max_concurrency'
+CONF_SUNRISE_OFFSET = 'sunrise_offset'
+CONF_SUNSET_OFFSET = 'sunset_offset'
+CONF_NIGHT_SCAN_INTERVAL = 'night_scan_interval'
+CONF_MAX_BACKOFF = 'max_backoff'
+CONF_DEADBAND = 'deadband'
+CONF_INVERTERS = 'inverters'
+CONF_CONNECTION_LIMIT = 'connection_limit'
+CONF_CONNECTION_LIMIT_PER_HOST = 'connection_limit_per_host'
+CONF_BATCH = 'batch'
+CONF_AGGREGATE = 'aggregate'
+CONF_DIAGNOSTICS = 'diagnostics'
+CONF_PUSH_TOKEN = 'push_token'
+CONF_PUSH_TIMEOUT = 'push_timeout'
+CONF_TRANSPORT = 'transport'
+CONF_MODBUS_PORT = 'modbus_port'
+CONF_SAMPLE_INTERVAL = 'sample_interval'
+CONF_SAMPLED_CONDITIONS = 'sampled_conditions'
+CONF_BACKFILL = 'backfill'
+CONF_BACKFILL_WINDOW = 'backfill_window'
+CONF_REQUEST_TIMEOUT = 'request_timeout'
+CONF_RETRY_BUDGET = 'retry_budget'
 
 DEFAULT_SCAN_INTERVAL = timedelta(seconds=60)
+DEFAULT_MAX_CONCURRENCY = 3
+DEFAULT_NIGHT_SCAN_INTERVAL = timedelta(minutes=10)
+DEFAULT_MAX_BACKOFF = timedelta(minutes=15)
+DEFAULT_CONNECTION_LIMIT = 20
+DEFAULT_CONNECTION_LIMIT_PER_HOST = 3
+KEEPALIVE_TIMEOUT = 120
+DEFAULT_PUSH_TIMEOUT = timedelta(minutes=5)
+DEFAULT_SAMPLED_CONDITIONS = ['ac_power', 'grid_usage', 'house_load']
+DEFAULT_BACKFILL_WINDOW = timedelta(days=7)
+DEFAULT_REQUEST_TIMEOUT = timedelta(seconds=10)
+DEFAULT_RETRY_BUDGET = 2
+
+# key of the inverter status code in the compact inverter data
+STATUS_CODE = 'StatusCode'
+
+# inverter status code reported while feeding in, anything else means the
+# inverter is starting up, in standby or in error
+INVERTER_STATUS_RUNNING = 7
 
 SCOPE_TYPES = ['Device', 'System']
 UNIT_TYPES = ['Wh', 'kWh', 'MWh']
 POWER_UNIT_TYPES = ['W', 'kW', 'MW']
 MODEL_TYPES = ['symo', 'gen24']
+TRANSPORT_TYPES = ['http', 'modbus']
 
 # Key: ['device', 'system', 'json_key', 'name', 'unit', 'convert_units', 'icon']
 SENSOR_TYPES = {
@@ -76,7 +161,17 @@ SENSOR_TYPES = {
     'smartmeter_voltage_ac_phase_two': ['smartmeter', False, 'Voltage_AC_Phase_2', 'SmartMeter Voltage AC Phase 2', 'V', False, 'mdi:solar-power'],
     'smartmeter_voltage_ac_phase_three': ['smartmeter', False, 'Voltage_AC_Phase_3', 'SmartMeter Voltage AC Phase 3', 'V', False, 'mdi:solar-power'],
     'smartmeter_energy_ac_consumed': ['smartmeter', False, 'EnergyReal_WAC_Sum_Consumed', 'SmartMeter Energy AC Consumed', 'Wh', 'energy', 'mdi:solar-power'],
-    'smartmeter_energy_ac_sold': ['smartmeter', False, 'EnergyReal_WAC_Sum_Produced', 'SmartMeter Energy AC Sold', 'Wh', 'energy', 'mdi:solar-power']
+    'smartmeter_energy_ac_sold': ['smartmeter', False, 'EnergyReal_WAC_Sum_Produced', 'SmartMeter Energy AC Sold', 'Wh', 'energy', 'mdi:solar-power'],
+    'grid_import_power': ['powerflow', False, 'Grid_Import', 'Grid Import Power', 'W', 'power', 'mdi:transmission-tower-export'],
+    'grid_export_power': ['powerflow', False, 'Grid_Export', 'Grid Export Power', 'W', 'power', 'mdi:transmission-tower-import'],
+    'self_consumption_power': ['powerflow', False, 'Self_Consumption', 'Self Consumption Power', 'W', 'power', 'mdi:home-lightning-bolt'],
+    'battery_charge_power': ['powerflow', False, 'Battery_Charge', 'Battery Charge Power', 'W', 'power', 'mdi:battery-arrow-up'],
+    'battery_discharge_power': ['powerflow', False, 'Battery_Discharge', 'Battery Discharge Power', 'W', 'power', 'mdi:battery-arrow-down'],
+    'grid_import_energy': ['powerflow', False, 'Grid_Import', 'Grid Import Energy Today', 'kWh', 'energy', 'mdi:transmission-tower-export'],
+    'grid_export_energy': ['powerflow', False, 'Grid_Export', 'Grid Export Energy Today', 'kWh', 'energy', 'mdi:transmission-tower-import'],
+    'self_consumption_energy': ['powerflow', False, 'Self_Consumption', 'Self Consumption Energy Today', 'kWh', 'energy', 'mdi:home-lightning-bolt'],
+    'battery_charge_energy': ['powerflow', False, 'Battery_Charge', 'Battery Charge Energy Today', 'kWh', 'energy', 'mdi:battery-arrow-up'],
+    'battery_discharge_energy': ['powerflow', False, 'Battery_Discharge', 'Battery Discharge Energy Today', 'kWh', 'energy', 'mdi:battery-arrow-down'],
 }
 # the gen24 inverter has different names for some sensors
 SENSOR_TYPES_GEN24 = {
@@ -89,9 +184,60 @@ SENSOR_TYPES_GEN24 = {
     'smartmeter_energy_ac_consumed': ['smartmeter', False, 'SMARTMETER_ENERGYACTIVE_CONSUMED_SUM_F64', 'SmartMeter Energy AC Consumed', 'Wh', 'energy', 'mdi:solar-power'],
     'smartmeter_energy_ac_sold': ['smartmeter', False, 'SMARTMETER_ENERGYACTIVE_PRODUCED_SUM_F64', 'SmartMeter Energy AC Sold', 'Wh', 'energy', 'mdi:solar-power']
 }
+# sensor types of each model that differ from SENSOR_TYPES
+MODEL_SENSOR_TYPES = {
+    'symo': {},
+    'gen24': SENSOR_TYPES_GEN24,
+}
 
-PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
+# energy flows derived from the PowerFlow (or SmartMeter) power values
+GRID_FLOW_KEYS = ('Grid_Import', 'Grid_Export')
+DERIVED_KEYS = GRID_FLOW_KEYS + ('Self_Consumption', 'Battery_Charge', 'Battery_Discharge')
+# grid power reported by the SmartMeter at the feed-in point, positive when importing
+METER_POWER_KEYS = ('PowerReal_P_Sum', 'SMARTMETER_POWERACTIVE_MEAN_SUM_F64')
+# sensors integrating a derived power into the energy of the current day
+INTEGRATED_TYPES = ('grid_import_energy', 'grid_export_energy', 'self_consumption_energy', 'battery_charge_energy', 'battery_discharge_energy')
+# the energy flow sensors are only added when monitored explicitly
+DERIVED_TYPES = ('grid_import_power', 'grid_export_power', 'self_consumption_power', 'battery_charge_power', 'battery_discharge_power') + INTEGRATED_TYPES
+DEFAULT_MONITORED_CONDITIONS = [variable for variable in SENSOR_TYPES if variable not in DERIVED_TYPES]
+
+INVERTER_SCHEMA = vol.Schema({
     vol.Required(CONF_IP_ADDRESS): cv.string,
+    vol.Required(CONF_NAME): cv.string,
+    vol.Optional(CONF_DEVICE_ID, default='1'): cv.string,
+    vol.Optional(CONF_POWERFLOW): cv.boolean,
+    vol.Optional(CONF_SMARTMETER): cv.boolean,
+    vol.Optional(CONF_SMARTMETER_DEVICE_ID): cv.string,
+    vol.Optional(CONF_MODBUS_PORT): cv.port,
+    vol.Optional(CONF_MODEL): vol.In(MODEL_TYPES),
+})
+
+# Key: ['name', 'unit', 'icon']
+DIAGNOSTIC_TYPES = {
+    'request_latency': ['Request Latency', 'ms', 'mdi:timer-outline'],
+    'success_rate': ['Request Success Rate', '%', 'mdi:check-network-outline'],
+    'consecutive_failures': ['Consecutive Failures', None, 'mdi:alert-circle-outline'],
+    'data_age': ['Data Age', 's', 'mdi:clock-outline'],
+}
+
+# upper bounds in seconds of the request latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# request counts are halved past this many requests so metrics follow recent behaviour
+METRICS_WINDOW = 500
+
+# request timeouts follow a high percentile of the latest latencies, with a
+# floor and the configured request_timeout as ceiling
+LATENCY_SAMPLES = 50
+MIN_LATENCY_SAMPLES = 5
+TIMEOUT_PERCENTILE = 0.95
+TIMEOUT_FACTOR = 3
+TIMEOUT_FLOOR = 1.0
+# pause before retrying a request that failed on the network
+RETRY_DELAY = 0.2
+
+PLATFORM_SCHEMA = vol.All(PLATFORM_SCHEMA.extend({
+    vol.Optional(CONF_IP_ADDRESS): cv.string,
+    vol.Optional(CONF_INVERTERS): vol.All(cv.ensure_list, [INVERTER_SCHEMA]),
     vol.Optional(CONF_MODEL, default="symo"):
         vol.In(MODEL_TYPES),
     vol.Optional(CONF_DEVICE_ID, default='1'): cv.string,
@@ -103,119 +249,595 @@ PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend({
     vol.Optional(CONF_POWER_UNITS, default='W'):
         vol.In(POWER_UNIT_TYPES),
     vol.Optional(CONF_POWERFLOW, default=False): cv.boolean,
-    vol.Optional(CONF_MONITORED_CONDITIONS, default=list(SENSOR_TYPES)):
+    vol.Optional(CONF_MONITORED_CONDITIONS, default=DEFAULT_MONITORED_CONDITIONS):
         vol.All(cv.ensure_list, [vol.In(SENSOR_TYPES)]),
     vol.Optional(CONF_SMARTMETER, default=False): cv.boolean,
     vol.Optional(CONF_SMARTMETER_DEVICE_ID, default='0'): cv.string,
     vol.Optional(CONF_ALWAYS_LOG, default=True): cv.boolean,
-})
+    vol.Optional(CONF_MAX_CONCURRENCY, default=DEFAULT_MAX_CONCURRENCY):
+        vol.All(vol.Coerce(int), vol.Range(min=1)),
+    vol.Optional(CONF_SUNRISE_OFFSET, default=timedelta(0)): cv.time_period,
+    vol.Optional(CONF_SUNSET_OFFSET, default=timedelta(0)): cv.time_period,
+    vol.Optional(CONF_NIGHT_SCAN_INTERVAL, default=DEFAULT_NIGHT_SCAN_INTERVAL): cv.time_period,
+    vol.Optional(CONF_MAX_BACKOFF, default=DEFAULT_MAX_BACKOFF): cv.time_period,
+    vol.Optional(CONF_DEADBAND, default={}): vol.Schema({
+        vol.In(SENSOR_TYPES): vol.All(vol.Coerce(float), vol.Range(min=0)),
+    }),
+    vol.Optional(CONF_CONNECTION_LIMIT, default=DEFAULT_CONNECTION_LIMIT):
+        vol.All(vol.Coerce(int), vol.Range(min=1)),
+    vol.Optional(CONF_CONNECTION_LIMIT_PER_HOST, default=DEFAULT_CONNECTION_LIMIT_PER_HOST):
+        vol.All(vol.Coerce(int), vol.Range(min=1)),
+    vol.Optional(CONF_BATCH, default=False): cv.boolean,
+    vol.Optional(CONF_AGGREGATE, default=False): cv.boolean,
+    vol.Optional(CONF_DIAGNOSTICS, default=False): cv.boolean,
+    vol.Optional(CONF_PUSH_TOKEN): cv.string,
+    vol.Optional(CONF_PUSH_TIMEOUT, default=DEFAULT_PUSH_TIMEOUT): cv.time_period,
+    vol.Optional(CONF_TRANSPORT, default='http'):
+        vol.In(TRANSPORT_TYPES),
+    vol.Optional(CONF_MODBUS_PORT, default=DEFAULT_MODBUS_PORT): cv.port,
+    vol.Optional(CONF_SAMPLE_INTERVAL): cv.time_period,
+    vol.Optional(CONF_SAMPLED_CONDITIONS, default=DEFAULT_SAMPLED_CONDITIONS):
+        vol.All(cv.ensure_list, [vol.In(SENSOR_TYPES)]),
+    vol.Optional(CONF_BACKFILL, default=False): cv.boolean,
+    vol.Optional(CONF_BACKFILL_WINDOW, default=DEFAULT_BACKFILL_WINDOW): cv.time_period,
+    vol.Optional(CONF_REQUEST_TIMEOUT, default=DEFAULT_REQUEST_TIMEOUT): cv.time_period,
+    vol.Optional(CONF_RETRY_BUDGET, default=DEFAULT_RETRY_BUDGET):
+        vol.All(vol.Coerce(int), vol.Range(min=0)),
+}), cv.has_at_least_one_key(CONF_IP_ADDRESS, CONF_INVERTERS))
+
+def _unit_divisor(convert_units, units, json_key):
+    """Return the divisor converting a raw Solar API value to the sensor unit."""
+    if convert_units in ("energy", "power"):
+        if units in ("MWh", "MW"):
+            return 1000000
+        if units in ("kWh", "kW"):
+            return 1000
+        return 1
+    if json_key == "DAY_ENERGY":
+        # day energy always gets converted to kWh
+        return 1000
+    return 1
+
+class SensorDescription(NamedTuple):
+    """Everything needed to create and update a sensor of one type and model."""
+
+    key: str
+    device: str
+    system: bool
+    json_key: str
+    name: str
+    unit: str
+    convert_units: str
+    icon: str
+    device_class: str
+    state_class: str
+    # divisor converting the raw value, by sensor unit
+    divisors: MappingProxyType
+
+def _describe(key, device, system, json_key, name, unit, convert_units, icon):
+    """Return the description of a SENSOR_TYPES entry."""
+    # add attributes to support Energy dashboard and statistics for power sensors, new in HA 2021.8
+    # and updated in 2021.9 due to bugs in the orginal HA implementation.
+    # ref https://developers.home-assistant.io/docs/core/entity/sensor/
+    device_class = None
+    state_class = None
+    # the units the sensor can be configured in
+    sensor_units = (unit,)
+    if convert_units == "power":
+        device_class = DEVICE_CLASS_POWER
+        state_class = STATE_CLASS_MEASUREMENT
+        sensor_units = POWER_UNIT_TYPES
+    elif convert_units == "energy":
+        device_class = DEVICE_CLASS_ENERGY
+        state_class = STATE_CLASS_TOTAL_INCREASING
+        sensor_units = UNIT_TYPES
+    divisors = MappingProxyType({units: _unit_divisor(convert_units, units, json_key) for units in sensor_units})
+    return SensorDescription(key, device, system, json_key, name, unit, convert_units, icon, device_class, state_class, divisors)
+
+def _build_descriptions():
+    """Return the read-only sensor descriptions of every model."""
+    descriptions = {}
+    for model in MODEL_TYPES:
+        sensor_types = dict(SENSOR_TYPES, **MODEL_SENSOR_TYPES[model])
+        descriptions[model] = MappingProxyType({key: _describe(key, *sensor_type) for key, sensor_type in sensor_types.items()})
+    return MappingProxyType(descriptions)
+
+def _grid_flows(grid):
+    """Split a grid power, positive when importing, into import and export."""
+    if grid is None:
+        return {}
+    return {'Grid_Import': max(grid, 0), 'Grid_Export': max(-grid, 0)}
+
+def _energy_flows(site):
+    """Derive the energy flows of a PowerFlow site snapshot."""
+    flows = _grid_flows(site.get('P_Grid'))
+    # PV power used on site, by the house or to charge the battery
+    flows['Self_Consumption'] = max((site.get('P_PV') or 0) - flows.get('Grid_Export', 0), 0)
+    battery = site.get('P_Akku')
+    if battery is not None:
+        # the battery power is positive when discharging
+        flows['Battery_Charge'] = max(-battery, 0)
+        flows['Battery_Discharge'] = max(battery, 0)
+    return flows
+
+def _compile_extractor(description, scope, units, device_id=None):
+    """Compile a monitored condition into a function reading it from a payload.
+
+    The returned function takes the fetcher's latest data and returns the
+    value converted to units and rounded, or None if the key is missing.
+    Values reported as 'null' are read as 0. For System scope payloads,
+    device_id selects one device and None sums all of them.
+    """
+    device = description.device
+    json_key = description.json_key
+    divisor = description.divisors[units]
+
+    if device == 'inverter' and scope == 'System' and device_id is not None:
+        def read(data):
+            values = data.get(json_key)
+            if values is None or device_id not in values:
+                return None
+            return values[device_id] or 0
+    elif device == 'inverter' and scope == 'System':
+        def read(data):
+            values = data.get(json_key)
+            if values is None:
+                return None
+            return sum(value or 0 for value in values.values())
+    elif device == 'smartmeter' and scope == 'System' and device_id is not None:
+        def read(data):
+            meter = data.get(device_id)
+            if meter is None or json_key not in meter:
+                return None
+            return meter[json_key] or 0
+    elif device == 'smartmeter' and scope == 'System':
+        def read(data):
+            values = [meter[json_key] for meter in data.values() if json_key in meter]
+            if not values:
+                return None
+            return sum(value or 0 for value in values)
+    else:
+        def read(data):
+            if json_key not in data:
+                return None
+            return data[json_key] or 0
+
+    if divisor == 1:
+        def extract(data):
+            value = read(data)
+            return None if value is None else round(value, 2)
+    else:
+        def extract(data):
+            value = read(data)
+            return None if value is None else round(value / divisor, 2)
+
+    return extract
+
+# built once, the tables of one model never see the names of another
+SENSOR_DESCRIPTIONS = _build_descriptions()
 
 async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
     """Set up the Fronius inverter sensor."""
 
-    session = async_get_clientsession(hass)
-    ip_address = config[CONF_IP_ADDRESS]
-    model = config[CONF_MODEL]
-    device_id = config.get(CONF_DEVICE_ID)
-    scope = config.get(CONF_SCOPE)
-    units = config.get(CONF_UNITS)
-    power_units = config.get(CONF_POWER_UNITS)
-    name = config.get(CONF_NAME)
-    powerflow = config.get(CONF_POWERFLOW)
-    smartmeter = config.get(CONF_SMARTMETER)
-    smartmeter_device_id = config.get(CONF_SMARTMETER_DEVICE_ID)
-    scan_interval = config.get(CONF_SCAN_INTERVAL, DEFAULT_SCAN_INTERVAL)
-    always_log = config.get(CONF_ALWAYS_LOG)
+    session = async_get_session(hass, config[CONF_CONNECTION_LIMIT], config[CONF_CONNECTION_LIMIT_PER_HOST])
+
+    if not hass.services.has_service(DOMAIN, SERVICE_DUMP_DIAGNOSTICS):
+        hass.services.async_register(DOMAIN, SERVICE_DUMP_DIAGNOSTICS, async_dump_diagnostics_service(hass))
+    if not hass.services.has_service(DOMAIN, SERVICE_BACKFILL):
+        hass.services.async_register(DOMAIN, SERVICE_BACKFILL, async_backfill_service(hass),
+                                     schema=vol.Schema({vol.Optional(ATTR_ENTITY_ID): cv.entity_ids}))
+
+    # a fleet lists its inverters, otherwise the entry describes a single one
+    inverters = config.get(CONF_INVERTERS)
+    if not inverters:
+        inverters = [{
+            CONF_IP_ADDRESS: config[CONF_IP_ADDRESS],
+            CONF_NAME: config[CONF_NAME],
+            CONF_DEVICE_ID: config[CONF_DEVICE_ID],
+        }]
+
+    if CONF_PUSH_TOKEN in config:
+        # the token only authenticates pushes for the Datamanagers of this entry
+        async_get_push_view(hass).add_token(config[CONF_PUSH_TOKEN], {inverter[CONF_IP_ADDRESS] for inverter in inverters})
+
+    backfill_sites = hass.data.setdefault(DOMAIN, {}).setdefault(DATA_BACKFILL, [])
+    registered = len(backfill_sites)
 
-    if model == 'gen24':
-        _LOGGER.debug("GEN24 configured, updating sensor list")
-        # update sensors since gen24 has different names for some of them
-        for variable in SENSOR_TYPES:
-            if variable in SENSOR_TYPES_GEN24:
-                SENSOR_TYPES[variable] = SENSOR_TYPES_GEN24[variable]
-    _LOGGER.debug(SENSOR_TYPES)
+    dev = []
+    if config[CONF_BATCH] and config[CONF_TRANSPORT] == 'modbus':
+        _LOGGER.warning("Batching is not available over Modbus, polling each inverter on its own")
+    if config[CONF_BATCH] and config[CONF_TRANSPORT] == 'http':
+        # one System scope request per Datamanager serves all of its devices
+        sites = {}
+        for inverter in inverters:
+            sites.setdefault(inverter[CONF_IP_ADDRESS], []).append(inverter)
+        for ip_address, site_inverters in sites.items():
+            aggregate_name = config[CONF_NAME] if len(sites) == 1 else "{} {}".format(config[CONF_NAME], ip_address)
+            dev.extend(await async_setup_site(hass, session, config, ip_address, site_inverters, aggregate_name))
+    else:
+        for inverter in inverters:
+            dev.extend(await async_setup_inverter(hass, session, config, inverter))
+
+    # the sensors start with their restored state and get their first
+    # values from the coordinators polling in the background
+    async_add_entities(dev)
+
+    if config[CONF_BACKFILL]:
+        async_start_backfill(hass, backfill_sites[registered:])
+
+async def async_setup_inverter(hass, session, config, inverter):
+    """Set up the fetchers, coordinator and sensors of one inverter."""
+
+    ip_address = inverter[CONF_IP_ADDRESS]
+    device_id = inverter[CONF_DEVICE_ID]
+    powerflow = inverter.get(CONF_POWERFLOW, config[CONF_POWERFLOW])
+    smartmeter = inverter.get(CONF_SMARTMETER, config[CONF_SMARTMETER])
+    smartmeter_device_id = inverter.get(CONF_SMARTMETER_DEVICE_ID, config[CONF_SMARTMETER_DEVICE_ID])
+    scope = config.get(CONF_SCOPE)
 
+    # fetchers come from the shared registry so that identical requests,
+    # e.g. the powerflow of a Datamanager serving several inverters, are made once
     fetchers = []
-    inverter_data = InverterData(session, ip_address, device_id, scope)
+    if config[CONF_TRANSPORT] == 'modbus':
+        # Modbus reads one device at a time, the powerflow is only served over HTTP
+        client = async_get_modbus_client(hass, ip_address, inverter.get(CONF_MODBUS_PORT, config[CONF_MODBUS_PORT]))
+        inverter_data = async_get_fetcher(hass, ModbusInverterData, client, ip_address, device_id, 'Device')
+        # the site energy registers are read by the first inverter of the Datamanager only
+        site_readers = hass.data[DOMAIN].setdefault(DATA_MODBUS_SITES, {})
+        if site_readers.setdefault(client.address, inverter_data) is inverter_data:
+            inverter_data.read_site()
+    else:
+        inverter_data = async_get_fetcher(hass, InverterData, session, ip_address, device_id, scope)
     fetchers.append(inverter_data)
     if powerflow:
-        powerflow_data = PowerflowData(session, ip_address, None, None)
+        powerflow_data = async_get_fetcher(hass, PowerflowData, session, ip_address, None, None)
         fetchers.append(powerflow_data)
     if smartmeter:
-        smartmeter_data = SmartMeterData(session, ip_address, smartmeter_device_id, "Device")
+        if config[CONF_TRANSPORT] == 'modbus':
+            smartmeter_data = async_get_fetcher(hass, ModbusSmartMeterData, client, ip_address, smartmeter_device_id, 'Device')
+        else:
+            smartmeter_data = async_get_fetcher(hass, SmartMeterData, session, ip_address, smartmeter_device_id, "Device")
         fetchers.append(smartmeter_data)
 
-    def fetch_executor(fetcher):
-        async def fetch_data(*_):
-            await fetcher.async_update()
-        return fetch_data
+    fetcher_by_device = {'inverter': inverter_data}
+    if powerflow:
+        fetcher_by_device['powerflow'] = powerflow_data
+    if smartmeter:
+        fetcher_by_device['smartmeter'] = smartmeter_data
 
-    for fetcher in fetchers:
-        fetch = fetch_executor(fetcher)
-        await fetch()
-        async_track_time_interval(hass, fetch, scan_interval)
+    # gen24 inverters have different names for some sensors
+    descriptions = SENSOR_DESCRIPTIONS[inverter.get(CONF_MODEL, config[CONF_MODEL])]
+    dev = create_sensors(hass, config, inverter[CONF_NAME], descriptions, fetcher_by_device)
+    async_register_backfill(hass, session, config, ip_address, device_id, dev)
+    if config[CONF_DIAGNOSTICS]:
+        dev.extend(create_diagnostic_sensors(hass, inverter[CONF_NAME], fetchers))
+
+    # one coordinator per inverter polls every endpoint in the same tick
+    async_start_coordinator(hass, config, fetchers)
+
+    return dev
+
+async def async_setup_site(hass, session, config, ip_address, inverters, aggregate_name):
+    """Set up the devices behind one Datamanager from System scope requests.
+
+    Inverter and meter values of every device come from one request per
+    endpoint and are fanned out to per-device sensors, plus sensors summing
+    all devices if aggregate is set.
+    """
+
+    fetchers = []
+    inverter_data = async_get_fetcher(hass, InverterData, session, ip_address, None, 'System')
+    fetchers.append(inverter_data)
+    powerflow_data = None
+    smartmeter_data = None
+
+    dev = []
+    for inverter in inverters:
+        fetcher_by_device = {'inverter': inverter_data}
+        if inverter.get(CONF_POWERFLOW, config[CONF_POWERFLOW]):
+            if powerflow_data is None:
+                powerflow_data = async_get_fetcher(hass, PowerflowData, session, ip_address, None, None)
+                fetchers.append(powerflow_data)
+            fetcher_by_device['powerflow'] = powerflow_data
+        if inverter.get(CONF_SMARTMETER, config[CONF_SMARTMETER]):
+            if smartmeter_data is None:
+                smartmeter_data = async_get_fetcher(hass, SmartMeterData, session, ip_address, None, 'System')
+                fetchers.append(smartmeter_data)
+            fetcher_by_device['smartmeter'] = smartmeter_data
+
+        smartmeter_device_id = inverter.get(CONF_SMARTMETER_DEVICE_ID, config[CONF_SMARTMETER_DEVICE_ID])
+        descriptions = SENSOR_DESCRIPTIONS[inverter.get(CONF_MODEL, config[CONF_MODEL])]
+        sensors = create_sensors(hass, config, inverter[CONF_NAME], descriptions, fetcher_by_device, inverter[CONF_DEVICE_ID], smartmeter_device_id)
+        async_register_backfill(hass, session, config, ip_address, inverter[CONF_DEVICE_ID], sensors)
+        dev.extend(sensors)
+
+    if config[CONF_AGGREGATE]:
+        fetcher_by_device = {'inverter': inverter_data}
+        if smartmeter_data is not None:
+            fetcher_by_device['smartmeter'] = smartmeter_data
+        # the per-device sensors may already be named after the entry
+        total_name = "{} Total".format(aggregate_name)
+        dev.extend(create_sensors(hass, config, total_name, SENSOR_DESCRIPTIONS[config[CONF_MODEL]], fetcher_by_device))
+
+    if config[CONF_DIAGNOSTICS]:
+        dev.extend(create_diagnostic_sensors(hass, aggregate_name, fetchers))
+
+    async_start_coordinator(hass, config, fetchers)
+
+    return dev
+
+def create_sensors(hass, config, name, descriptions, fetcher_by_device, device_id=None, smartmeter_device_id=None):
+    """Create the monitored sensors served by the given fetchers.
+
+    descriptions are the SENSOR_DESCRIPTIONS of the inverter model.
+
+    For System scope fetchers, device_id and smartmeter_device_id select the
+    values of one device from the batched response, and None sums the values
+    of all devices.
+    """
+    units = config.get(CONF_UNITS)
+    power_units = config.get(CONF_POWER_UNITS)
+    always_log = config.get(CONF_ALWAYS_LOG)
+    sunrise_offset = config.get(CONF_SUNRISE_OFFSET)
+    sunset_offset = config.get(CONF_SUNSET_OFFSET)
+    deadband = config.get(CONF_DEADBAND)
+    # integrate across night polls, but not across outages
+    max_gap = 2 * config.get(CONF_NIGHT_SCAN_INTERVAL, DEFAULT_NIGHT_SCAN_INTERVAL)
+    sample_size = _sample_window_size(config)
+    sampled_conditions = config.get(CONF_SAMPLED_CONDITIONS)
+    powerflow = 'powerflow' in fetcher_by_device
+    smartmeter = 'smartmeter' in fetcher_by_device
+    daylight = async_get_daylight_window(hass)
 
     dev = []
     for variable in config[CONF_MONITORED_CONDITIONS]:
 
-        device = SENSOR_TYPES[variable][0]
-        system = SENSOR_TYPES[variable][1]
-        sensor_units = SENSOR_TYPES[variable][4]
-        convert_units = SENSOR_TYPES[variable][5]
+        description = descriptions[variable]
+        device = description.device
+        json_key = description.json_key
+        sensor_units = description.unit
+        convert_units = description.convert_units
 
         if convert_units == 'power':
             sensor_units = power_units
-        elif convert_units == 'energy':
+        elif convert_units == 'energy' and variable not in INTEGRATED_TYPES:
+            # the daily counters keep kWh, units is sized for lifetime totals
             sensor_units = units
 
-        sensor = "sensor." + name + "_" + SENSOR_TYPES[variable][3]
-        state = hass.states.get(sensor)
+        fetcher = fetcher_by_device.get(device)
+        if fetcher is None and json_key in GRID_FLOW_KEYS and 'smartmeter' in fetcher_by_device and fetcher_by_device['smartmeter'].scope == 'Device':
+            # without the PowerFlow the grid flows come from the SmartMeter
+            fetcher = fetcher_by_device['smartmeter']
+        if fetcher is None:
+            continue
+        scope = fetcher.scope
+        extract_id = smartmeter_device_id if device == 'smartmeter' else device_id
+        if config[CONF_BATCH] and device == 'inverter' and not description.system:
+            # System scope responses only carry the power and energy values
+            continue
+        if device == 'smartmeter' and scope == 'System' and extract_id is None and not convert_units:
+            # summing currents or voltages of several meters is meaningless
+            continue
+        if not fetcher.serves(json_key):
+            continue
+
+        _LOGGER.debug("Adding %s sensor: %s, %s, %s, %s, %s", device, name, variable, scope, sensor_units, extract_id)
+        # the key of the sensor's value in the fetcher, see FroniusSensor.data_key
+        data_key = (name, variable)
+        if variable in INTEGRATED_TYPES:
+            fetcher.add_extractor(data_key, description, EnergyIntegrator(json_key, description.divisors[sensor_units], max_gap), deadband.get(variable, 0))
+            fetcher.add_integrator(data_key)
+        else:
+            # compile the lookup and unit conversion once instead of on every update
+            fetcher.add_extractor(data_key, description, _compile_extractor(description, scope, sensor_units, extract_id), deadband.get(variable, 0))
+            if sample_size and variable in sampled_conditions:
+                fetcher.add_sample_window(data_key, sample_size)
+        dev.append(FroniusSensor(fetcher, name, variable, scope, sensor_units, device_id, powerflow, smartmeter, always_log, daylight, sunrise_offset, sunset_offset))
+
+    return dev
+
+def _sample_interval(config):
+    """Return the configured sample interval, or None if sampling is off."""
+    sample_interval = config.get(CONF_SAMPLE_INTERVAL)
+    scan_interval = config.get(CONF_SCAN_INTERVAL, DEFAULT_SCAN_INTERVAL)
+    if not sample_interval or sample_interval >= scan_interval:
+        return None
+    return sample_interval
+
+def _sample_window_size(config):
+    """Return how many samples are aggregated into one published value."""
+    sample_interval = _sample_interval(config)
+    if sample_interval is None:
+        return 0
+    # room for one extra sample in case a tick is late
+    return ceil(config.get(CONF_SCAN_INTERVAL, DEFAULT_SCAN_INTERVAL) / sample_interval) + 1
+
+def create_diagnostic_sensors(hass, name, fetchers):
+    """Create the request health sensors of fetchers that have none yet."""
+    seen = hass.data.setdefault(DOMAIN, {}).setdefault(DATA_DIAGNOSTICS, set())
+    dev = []
+    for fetcher in fetchers:
+        # fetchers shared by several inverters only get one set of sensors
+        if fetcher.url in seen:
+            continue
+        seen.add(fetcher.url)
+        for diagnostic_type in DIAGNOSTIC_TYPES:
+            dev.append(FroniusDiagnosticSensor(fetcher, "{} {}".format(name, fetcher.endpoint), diagnostic_type))
+    return dev
+
+def async_dump_diagnostics_service(hass):
+    """Return the service handler logging the metrics of every fetcher."""
 
-        if device == "inverter":
-            _LOGGER.debug("Adding inverter sensor: {}, {}, {}, {}, {}, {}, {}, {}".format(inverter_data, name, variable, scope, sensor_units, device_id, powerflow, smartmeter))
-            dev.append(FroniusSensor(inverter_data, name, variable, scope, sensor_units, device_id, powerflow, smartmeter, always_log))
+    async def async_dump_diagnostics(call):
+        domain_data = hass.data.get(DOMAIN, {})
+        dump = {
+            'fetchers': {url: fetcher.metrics.as_dict() for url, fetcher in domain_data.get(DATA_FETCHERS, {}).items()},
+            'coordinators': [coordinator.as_dict() for coordinator in domain_data.get(DATA_COORDINATORS, [])],
+        }
+        _LOGGER.warning("Fronius diagnostics: %s", json.dumps(dump, indent=2, default=str))
+        hass.bus.async_fire(EVENT_DIAGNOSTICS, dump)
 
-        elif device == "powerflow" and powerflow:
-            _LOGGER.debug("Adding powerflow sensor: {}, {}, {}, {}, {}, {}, {}, {}".format(powerflow_data, name, variable, scope, sensor_units, device_id, powerflow, smartmeter))
-            dev.append(FroniusSensor(powerflow_data, name, variable, scope, sensor_units, device_id, powerflow, smartmeter, always_log))
+    return async_dump_diagnostics
 
-        elif device == "smartmeter" and smartmeter:
-            _LOGGER.debug("Adding meter sensor: {}, {}, {}, {}, {}, {}, {}, {}".format(smartmeter_data, name, variable, scope, sensor_units, device_id, powerflow, smartmeter))
-            dev.append(FroniusSensor(smartmeter_data, name, variable, scope, sensor_units, device_id, powerflow, smartmeter, always_log))
+def async_register_backfill(hass, session, config, ip_address, device_id, sensors):
+    """Remember the inverter sensors whose statistics can be backfilled from the archive."""
+    sensors = [sensor for sensor in sensors if sensor.archive_channel is not None]
+    if sensors:
+        site = (session, ip_address, device_id, sensors, config[CONF_BACKFILL_WINDOW])
+        hass.data.setdefault(DOMAIN, {}).setdefault(DATA_BACKFILL, []).append(site)
 
-    async_add_entities(dev, True)
+async def async_backfill_sites(hass, sites, entity_ids=None, since=None):
+    """Backfill the statistics of the sites one after the other, see async_backfill for since."""
+    for session, ip_address, device_id, sensors, window in sites:
+        targets = [sensor.backfill_target for sensor in sensors if entity_ids is None or sensor.entity_id in entity_ids]
+        targets = [target for target in targets if target is not None]
+        if targets:
+            await async_backfill(hass, session, ip_address, device_id, targets, window, since)
 
-class FroniusSensor(SensorEntity):
+def async_create_background_task(hass, target, name):
+    """Run target in a task that Home Assistant does not wait for while starting."""
+    if hasattr(hass, 'async_create_background_task'):
+        return hass.async_create_background_task(target, name)
+    # releases before 2023.3 only wait for the tasks they create themselves
+    return hass.loop.create_task(target)
+
+def async_start_backfill(hass, sites):
+    """Backfill the statistics of the sites once Home Assistant has started."""
+
+    async def start(_event=None):
+        async_create_background_task(hass, async_backfill_sites(hass, sites), 'fronius_inverter backfill')
+
+    if hass.is_running:
+        async_create_background_task(hass, async_backfill_sites(hass, sites), 'fronius_inverter backfill')
+    else:
+        # the recorder and the entity ids are only ready then
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STARTED, start)
+
+def async_backfill_outage(hass, hosts):
+    """Return the callback backfilling the statistics of the hosts recorded during an outage."""
+
+    def backfill(since):
+        # the recorder kept writing the stale states, so import the outage again
+        sites = [site for site in hass.data.get(DOMAIN, {}).get(DATA_BACKFILL, []) if site[1] in hosts]
+        if sites:
+            _LOGGER.info("Backfilling statistics of %s since %s", ', '.join(sorted(hosts)), since)
+            async_create_background_task(hass, async_backfill_sites(hass, sites, since=since), 'fronius_inverter backfill')
+
+    return backfill
+
+def async_backfill_service(hass):
+    """Return the service handler backfilling the statistics of every or the given sensors."""
+
+    async def async_backfill_statistics(call):
+        entity_ids = call.data.get(ATTR_ENTITY_ID)
+        await async_backfill_sites(hass, hass.data.get(DOMAIN, {}).get(DATA_BACKFILL, []), entity_ids)
+
+    return async_backfill_statistics
+
+def async_start_coordinator(hass, config, fetchers):
+    """Start polling the fetchers of one inverter or site in the background."""
+    coordinator = FroniusCoordinator(
+        hass,
+        fetchers,
+        config.get(CONF_SCAN_INTERVAL, DEFAULT_SCAN_INTERVAL),
+        config.get(CONF_MAX_CONCURRENCY),
+        config.get(CONF_NIGHT_SCAN_INTERVAL),
+        config.get(CONF_MAX_BACKOFF),
+        async_get_daylight_window(hass),
+        config.get(CONF_SUNRISE_OFFSET),
+        config.get(CONF_SUNSET_OFFSET),
+        config.get(CONF_PUSH_TIMEOUT),
+        _sample_interval(config),
+        config.get(CONF_REQUEST_TIMEOUT),
+        config.get(CONF_RETRY_BUDGET),
+        async_backfill_outage(hass, {fetcher.host for fetcher in fetchers}) if config.get(CONF_BACKFILL) else None,
+    )
+    hass.data.setdefault(DOMAIN, {}).setdefault(DATA_COORDINATORS, []).append(coordinator)
+    coordinator.async_start()
+    return coordinator
+
+def async_get_session(hass, limit, limit_per_host):
+    """Return the keep-alive connection pool shared by all fetchers.
+
+    The pool is created by the first platform entry set up, so its limits
+    apply to every entry.
+    """
+    domain_data = hass.data.setdefault(DOMAIN, {})
+    if DATA_SESSION not in domain_data:
+        connector = aiohttp.TCPConnector(limit=limit, limit_per_host=limit_per_host, keepalive_timeout=KEEPALIVE_TIMEOUT)
+        session = aiohttp.ClientSession(connector=connector)
+
+        async def close_session(_event):
+            await session.close()
+
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_CLOSE, close_session)
+        domain_data[DATA_SESSION] = session
+    return domain_data[DATA_SESSION]
+
+def async_get_modbus_client(hass, host, port):
+    """Return the Modbus connection to a Datamanager, shared by all of its devices."""
+    domain_data = hass.data.setdefault(DOMAIN, {})
+    if DATA_MODBUS_CLIENTS not in domain_data:
+        clients = domain_data[DATA_MODBUS_CLIENTS] = {}
+
+        async def close_clients(_event):
+            for client in clients.values():
+                client.close()
+
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_CLOSE, close_clients)
+    clients = domain_data[DATA_MODBUS_CLIENTS]
+    if (host, port) not in clients:
+        clients[(host, port)] = ModbusTcpClient(host, port)
+    return clients[(host, port)]
+
+def async_get_push_view(hass):
+    """Return the push receiver, registering it on first use."""
+    domain_data = hass.data.setdefault(DOMAIN, {})
+    if DATA_PUSH_VIEW not in domain_data:
+        view = FroniusPushView(domain_data.setdefault(DATA_FETCHERS, {}))
+        hass.http.register_view(view)
+        domain_data[DATA_PUSH_VIEW] = view
+    return domain_data[DATA_PUSH_VIEW]
+
+def async_get_fetcher(hass, fetcher_class, session, ip_address, device_id, scope):
+    """Return the fetcher for an endpoint, shared by every entry requesting the same URL."""
+    fetcher = fetcher_class(session, ip_address, device_id, scope)
+    registry = hass.data.setdefault(DOMAIN, {}).setdefault(DATA_FETCHERS, {})
+    if fetcher.url in registry:
+        _LOGGER.debug("Sharing fetcher for %s", fetcher.url)
+        return registry[fetcher.url]
+    registry[fetcher.url] = fetcher
+    return fetcher
+
+class FroniusSensor(SensorEntity, RestoreEntity):
     """Implementation of the Fronius inverter sensor."""
 
-    def __init__(self, device_data, name, sensor_type, scope, units, device_id, powerflow, smartmeter, always_log):
-        """Initialize the sensor."""
+    def __init__(self, device_data, name, sensor_type, scope, units, device_id, powerflow, smartmeter, always_log, daylight, sunrise_offset, sunset_offset):
+        """Initialize the sensor, described by the extractor added to device_data."""
         self._client = name
-        self._device = SENSOR_TYPES[sensor_type][0]
-        self._json_key = SENSOR_TYPES[sensor_type][2]
-        self._name = SENSOR_TYPES[sensor_type][3]
-        self._type = sensor_type
+        description = self._description = device_data.description((name, sensor_type))
+        self._device = description.device
+        self._json_key = description.json_key
+        self._name = description.name
+        self._type = description.key
         self._state = None
         self._device_id = device_id
         self._scope = scope
         self._units = units
-        self._unit = SENSOR_TYPES[sensor_type][4]
-        self._convert_units = SENSOR_TYPES[sensor_type][5]
+        self._unit = description.unit
+        self._convert_units = description.convert_units
         self._data = device_data
-        self._icon = SENSOR_TYPES[sensor_type][6]
+        self._icon = description.icon
         self._powerflow = powerflow
         self._smartmeter = smartmeter
         self._always_log = always_log
+        self._daylight = daylight
+        self._sunrise_offset = sunrise_offset
+        self._sunset_offset = sunset_offset
 
-        # add attributes to support Energy dashboard and statistics for power sensors, new in HA 2021.8
-        # and updated in 2021.9 due to bugs in the orginal HA implementation.
-        # ref https://developers.home-assistant.io/docs/core/entity/sensor/
-        if self._convert_units == "power":
-            self._attr_device_class = DEVICE_CLASS_POWER
-            self._attr_state_class = STATE_CLASS_MEASUREMENT
-        elif self._convert_units == "energy":
-            self._attr_device_class = DEVICE_CLASS_ENERGY
-            self._attr_state_class = STATE_CLASS_TOTAL_INCREASING
+        if description.device_class is not None:
+            self._attr_device_class = description.device_class
+            self._attr_state_class = description.state_class
 
     @property
     def name(self):
@@ -228,29 +850,36 @@ class FroniusSensor(SensorEntity):
         return self._state
 
     @property
-    def available(self, utcnow=None):
+    def available(self):
         if self._always_log:
             return True
 
-        if utcnow is None:
-            utcnow = dt_utcnow()
-        now = as_local(utcnow)
+        return self._daylight.is_daylight(dt_utcnow(), self._sunrise_offset, self._sunset_offset)
 
-        start_time = self.find_start_time(now)
-        stop_time = self.find_stop_time(now)
-
-        if as_local(start_time) <= now <= as_local(stop_time):
-            _LOGGER.debug("Sensor is running. Start/Stop time: {}, {}".format(as_local(start_time), as_local(stop_time)))
-            return True
-        else:
-            _LOGGER.debug("Sensor is not running. Start/Stop time: {}, {}".format(as_local(start_time), as_local(stop_time)))
-            return False
+    @property
+    def data_key(self):
+        """Return the key of this sensor's value in the fetcher."""
+        return (self._client, self._type)
 
     @property
     def unique_id(self):
         """Return the unique id."""
         return f"{self._client} {self._name}"
 
+    @property
+    def archive_channel(self):
+        """Return the Solar API archive channel holding the history of this sensor, if any."""
+        if self._device != 'inverter' or self._type not in ARCHIVE_CHANNELS:
+            return None
+        return ARCHIVE_CHANNELS[self._type][0]
+
+    @property
+    def backfill_target(self):
+        """Return the statistics this sensor is backfilled into, or None before it is added."""
+        if self.entity_id is None or self.archive_channel is None:
+            return None
+        return (self.entity_id, self._type, self.unit_of_measurement, self._description.divisors[self._units])
+
     @property
     def unit_of_measurement(self):
         """Return the unit of measurement of this entity, if any."""
@@ -260,9 +889,13 @@ class FroniusSensor(SensorEntity):
             return self._unit
 
     @property
-    def device_state_attributes(self):
+    def extra_state_attributes(self):
         """Return the state attributes."""
         attrs = {ATTR_ATTRIBUTION: ATTRIBUTION}
+        # sampled sensors report the mean as state and the window here
+        stats = self._data.sample_stats.get(self.data_key)
+        if stats:
+            attrs.update(stats)
         return attrs
 
     @property
@@ -281,83 +914,549 @@ class FroniusSensor(SensorEntity):
             self._state = STATE_UNAVAILABLE
             return
 
-        state = None
-        if self._data.latest_data and (self._json_key in self._data.latest_data):
-            _LOGGER.debug("Device: {}".format(self._device))
-            if self._device == 'inverter':
-                # Read data, if a value is 'null' convert it to 0
-                if self._scope == 'Device':
-                    state = self._data.latest_data[self._json_key]['Value']
-                    if state is None:
-                        _LOGGER.debug(">>>>> Converting {} from null to 0".format(self._json_key))
-                        state = 0
-                elif self._scope == 'System':
-                    for item in self._data.latest_data[self._json_key]['Values']:
-                        value = self._data.latest_data[self._json_key]['Values'][item]
-                        if value is None:
-                            _LOGGER.debug(">>>>> Converting {} from null to 0".format(self._json_key))
-                            value = 0
-                        state = state + value
-            elif self._device == 'powerflow' or self._device == 'smartmeter':
-                # Read data directly, if it is 'null' convert it to 0
-                state = self._data.latest_data[self._json_key]
-                if state is None:
-                    _LOGGER.debug(">>>>> Converting {} from null to 0".format(self._json_key))
-                    state = 0
-            _LOGGER.debug("State: {}".format(state))
-
-        # convert and round the result
-        if state is not None:
-            _LOGGER.debug("Sensor: {}".format(self._json_key))
-            if self._convert_units == "energy":
-                _LOGGER.debug("Converting energy ({}) to {}".format(state, self._units))
-                if self._units == "MWh":
-                    self._state = round(state / 1000000, 2)
-                elif self._units == "kWh":
-                    self._state = round(state / 1000, 2)
-                else:
-                    self._state = round(state, 2)
-            elif self._convert_units == "power":
-                _LOGGER.debug("Converting power ({}) to {}".format(state, self._units))
-                if self._units == "MW":
-                    self._state = round(state / 1000000, 2)
-                elif self._units == "kW":
-                    self._state = round(state / 1000, 2)
-                else:
-                    self._state = round(state, 2)
-            elif self._json_key == "DAY_ENERGY":
-                # day energy always gets converted to kWh
-                _LOGGER.debug("Converting day energy to kWh ({})".format(state))
-                self._state = round(state / 1000, 2)
-            else:
-                _LOGGER.debug("Rounding ({}) to two decimals".format(state))
-                self._state = round(state, 2)
-        else:
-            _LOGGER.debug(">>>>> State is None for {} <<<<<".format(self._json_key))
-            _LOGGER.debug("Latest data: {}".format(self._data.latest_data))
-        _LOGGER.debug("State converted ({})".format(self._state))
+        value = self._data.values.get(self.data_key)
+        if value is not None:
+            self._state = value
+        elif _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug(">>>>> State is None for %s <<<<<", self._json_key)
+            _LOGGER.debug("Latest data: %s", self._data.latest_data)
 
     async def async_added_to_hass(self):
-        """Register at data provider for updates."""
+        """Restore the last state and register at data provider for updates."""
+        await super().async_added_to_hass()
+        last_state = await self.async_get_last_state()
+        if self._state is None and last_state is not None and last_state.state not in (STATE_UNKNOWN, STATE_UNAVAILABLE):
+            try:
+                self._state = float(last_state.state)
+            except ValueError:
+                self._state = last_state.state
+            else:
+                if last_state.attributes.get(ATTR_UNIT_OF_MEASUREMENT) == self.unit_of_measurement:
+                    # counters computed here continue from the restored value
+                    self._data.restore_value(self.data_key, self._state, last_state.last_updated)
         await self._data.register(self)
 
     def __hash__(self):
         """Hash sensor by hashing its name."""
         return hash(self.name)
 
-    def find_start_time(self, now):
-        """Return sunrise or start_time if given."""
-        sunrise = get_astral_event_date(self.hass, SUN_EVENT_SUNRISE, now.date())
-        return sunrise
+class FroniusDiagnosticSensor(SensorEntity):
+    """Request health of one Fronius endpoint."""
+
+    def __init__(self, fetcher, name, diagnostic_type):
+        """Initialize the sensor."""
+        self._fetcher = fetcher
+        self._client = name
+        self._type = diagnostic_type
+        self._name = DIAGNOSTIC_TYPES[diagnostic_type][0]
+        self._unit = DIAGNOSTIC_TYPES[diagnostic_type][1]
+        self._icon = DIAGNOSTIC_TYPES[diagnostic_type][2]
+        self._state = None
+        if EntityCategory is not None:
+            self._attr_entity_category = EntityCategory.DIAGNOSTIC
+
+    @property
+    def name(self):
+        """Return the name of the sensor."""
+        return '{} {}'.format(self._client, self._name)
+
+    @property
+    def state(self):
+        """Return the state of the device."""
+        return self._state
+
+    @property
+    def unique_id(self):
+        """Return the unique id."""
+        return f"{self._client} {self._name}"
+
+    @property
+    def unit_of_measurement(self):
+        """Return the unit of measurement of this entity, if any."""
+        return self._unit
+
+    @property
+    def extra_state_attributes(self):
+        """Return the state attributes."""
+        metrics = self._fetcher.metrics
+        attrs = {ATTR_ATTRIBUTION: ATTRIBUTION, 'url': self._fetcher.url}
+        if self._type == 'request_latency':
+            attrs['histogram'] = metrics.histogram()
+            attrs['timeout_s'] = metrics.timeout
+            attrs['parse_time_ms'] = metrics.parse_time_ms
+            attrs['payload_bytes'] = metrics.payload_size
+        elif self._type == 'success_rate':
+            attrs['requests'] = metrics.requests
+            attrs['errors'] = dict(metrics.errors)
+            attrs['retries'] = metrics.retries
+        elif self._type == 'data_age':
+            attrs['last_success'] = metrics.last_success
+        return attrs
+
+    @property
+    def icon(self):
+        """Icon to use in the frontend, if any."""
+        return self._icon
+
+    @property
+    def should_poll(self):
+        """Device should not be polled, returns False."""
+        return False
+
+    async def async_update(self):
+        """Read the latest metrics of the endpoint."""
+        metrics = self._fetcher.metrics
+        if self._type == 'request_latency':
+            self._state = metrics.latency_ms
+        elif self._type == 'success_rate':
+            self._state = metrics.success_rate
+        elif self._type == 'consecutive_failures':
+            self._state = self._fetcher.failures
+        elif self._type == 'data_age':
+            self._state = metrics.data_age(dt_utcnow())
+
+    async def async_added_to_hass(self):
+        """Register at data provider for updates."""
+        self._fetcher.register_diagnostic(self)
+
+def async_get_daylight_window(hass):
+    """Return the daylight window cache shared by all sensors and fetchers."""
+    domain_data = hass.data.setdefault(DOMAIN, {})
+    if DATA_DAYLIGHT not in domain_data:
+        domain_data[DATA_DAYLIGHT] = DaylightWindow(hass)
+    return domain_data[DATA_DAYLIGHT]
+
+class DaylightWindow:
+    """Cache sunrise and sunset for the current local date and location."""
+
+    def __init__(self, hass):
+        """Initialize the cache."""
+        self._hass = hass
+        self._key = None
+        self._window = (None, None)
+
+    def window(self, now):
+        """Return the (sunrise, sunset) of the local date of now."""
+        local_date = as_local(now).date()
+        key = (local_date, self._hass.config.latitude, self._hass.config.longitude)
+        if key != self._key:
+            sunrise = get_astral_event_date(self._hass, SUN_EVENT_SUNRISE, local_date)
+            sunset = get_astral_event_date(self._hass, SUN_EVENT_SUNSET, local_date)
+            _LOGGER.debug("Daylight window for %s: %s, %s", local_date, sunrise, sunset)
+            self._key = key
+            self._window = (sunrise, sunset)
+        return self._window
+
+    def is_daylight(self, now, before_sunrise=timedelta(0), after_sunset=timedelta(0)):
+        """Return True if now is between sunrise and sunset, widened by the offsets."""
+        sunrise, sunset = self.window(now)
+        if sunrise is None or sunset is None:
+            # polar day or night, never switch the sensors off
+            return True
+        return sunrise - before_sunrise <= now <= sunset + after_sunset
+
+class FroniusCoordinator:
+    """Poll all endpoints of one inverter together and publish one snapshot.
+
+    The delay until the next poll adapts to the inverter: scan_interval while
+    it is producing, night_scan_interval while it sleeps outside the daylight
+    window, and an exponential backoff with jitter (capped at max_backoff)
+    while it cannot be reached at all.
+
+    With a sample_interval, fetchers with sampled values are polled every
+    sample_interval while producing and their samples aggregated, and
+    everything is published once per scan_interval.
+
+    Requests of one tick must end before the next tick, and share a budget
+    of retry_budget retries for network errors.
+
+    on_recovery is called with the last success before an outage once any
+    endpoint can be reached again.
+    """
+
+    def __init__(self, hass, fetchers, scan_interval, max_concurrency, night_scan_interval, max_backoff, daylight, sunrise_offset, sunset_offset, push_timeout,
+                 sample_interval=None, request_timeout=DEFAULT_REQUEST_TIMEOUT, retry_budget=DEFAULT_RETRY_BUDGET, on_recovery=None):
+        """Initialize the coordinator."""
+        self._hass = hass
+        self._fetchers = fetchers
+        self._scan_interval = scan_interval
+        self._night_scan_interval = max(night_scan_interval, scan_interval)
+        self._max_backoff = max(max_backoff, scan_interval)
+        self._daylight = daylight
+        self._sunrise_offset = sunrise_offset
+        self._sunset_offset = sunset_offset
+        self._push_timeout = push_timeout
+        self._sample_interval = sample_interval
+        self._last_publish = None
+        self._request_timeout = request_timeout.total_seconds()
+        self._retry_budget = retry_budget
+        self._on_recovery = on_recovery
+        self._outage_start = None
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._lock = asyncio.Lock()
+        self._failures = 0
+        self._is_daylight = None
+        self._unsub = None
+        self._task = None
+        self._running = False
+
+    async def _fetch(self, fetcher, budget):
+        """Fetch one endpoint within the concurrency cap."""
+        if fetcher.pushed_within(self._push_timeout):
+            # the Datamanager is pushing this endpoint, polling is only a fallback
+            return None
+        async with self._semaphore:
+            # reuse a result another coordinator fetched during this interval
+            return await fetcher.async_fetch((self._sample_interval or self._scan_interval) / 2, budget)
+
+    async def async_refresh(self, *_):
+        """Fetch every endpoint concurrently, then publish the results together."""
+        if self._lock.locked():
+            _LOGGER.debug("Previous poll still running, skipping this tick")
+            return
+
+        async with self._lock:
+            # sensors switch availability at the edges of the daylight
+            # window, so write all of them then even if no value changed
+            is_daylight = self._daylight.is_daylight(dt_utcnow(), self._sunrise_offset, self._sunset_offset)
+            force = is_daylight != self._is_daylight
+            self._is_daylight = is_daylight
+
+            # publish once per scan_interval, however long the ticks are;
+            # a sample tick firing slightly early still counts
+            now = monotonic()
+            publish = force or not self._sample_interval or self._last_publish is None or \
+                now - self._last_publish >= (self._scan_interval - self._sample_interval / 2).total_seconds()
+            if publish:
+                self._last_publish = now
+            # in between publishing ticks only the sampled endpoints are polled
+            fetchers = self._fetchers if publish else [fetcher for fetcher in self._fetchers if fetcher.sampled]
+            # a request still running at the next tick would only delay it
+            deadline = now + (self._sample_interval or self._scan_interval).total_seconds()
+            budget = RequestBudget(deadline, self._retry_budget, self._request_timeout)
+            results = await asyncio.gather(*(self._fetch(fetcher, budget) for fetcher in fetchers))
+
+            # back off only if nothing could be reached at all
+            if all(fetcher.unreachable for fetcher in fetchers):
+                if not self._failures:
+                    successes = [fetcher.metrics.last_success for fetcher in fetchers if fetcher.metrics.last_success is not None]
+                    self._outage_start = max(successes, default=None)
+                self._failures += 1
+            else:
+                if self._failures:
+                    _LOGGER.info("Inverter reachable again after %s failed polls", self._failures)
+                    if self._on_recovery is not None and self._outage_start is not None:
+                        self._on_recovery(self._outage_start)
+                    self._outage_start = None
+                self._failures = 0
+
+            if not publish:
+                for fetcher, data in zip(fetchers, results):
+                    fetcher.async_sample(data)
+                return
+
+            # only publish once every endpoint has answered so that all
+            # sensors see values taken at the same instant
+            for fetcher, data in zip(fetchers, results):
+                fetcher.async_publish(data, force)
+
+    def expire(self, publish=False):
+        """Make the next poll request every endpoint again.
+
+        With publish, the next poll also publishes as if a scan_interval had
+        passed since the last one.
+        """
+        for fetcher in self._fetchers:
+            fetcher.expire()
+        if publish:
+            self._last_publish = None
+
+    def next_interval(self):
+        """Return the delay until the next poll."""
+        if self._failures:
+            backoff = min(self._scan_interval * (2 ** min(self._failures - 1, 16)), self._max_backoff)
+            # full jitter keeps many sites from retrying in lockstep
+            return max(self._scan_interval, backoff * random.uniform(0.5, 1.0))
+
+        if any(fetcher.asleep for fetcher in self._fetchers) and not self._is_daylight:
+            return self._night_scan_interval
+
+        if self._sample_interval and any(fetcher.sampled for fetcher in self._fetchers):
+            return self._sample_interval
+        return self._scan_interval
+
+    def _schedule_refresh(self):
+        """Schedule the next poll."""
+        interval = self.next_interval()
+        _LOGGER.debug("Next poll in %s", interval)
+        self._unsub = async_call_later(self._hass, interval.total_seconds(), self._async_scheduled_refresh)
+
+    async def _async_scheduled_refresh(self, _now):
+        """Poll and schedule the next poll."""
+        self._unsub = None
+        try:
+            await self.async_refresh()
+        finally:
+            if self._running:
+                self._schedule_refresh()
+
+    def async_start(self):
+        """Start polling, with a first poll right away in the background."""
+        self._running = True
+        # an unreachable inverter must not hold up the start of Home Assistant
+        self._task = async_create_background_task(self._hass, self._async_scheduled_refresh(None), 'fronius_inverter poll')
+
+    @property
+    def fetchers(self):
+        """Return the fetchers polled by this coordinator."""
+        return self._fetchers
+
+    def as_dict(self):
+        """Return the polling state for diagnostics."""
+        return {
+            'urls': [fetcher.url for fetcher in self._fetchers],
+            'scan_interval': self._scan_interval.total_seconds(),
+            'sample_interval': self._sample_interval.total_seconds() if self._sample_interval else None,
+            'failed_polls': self._failures,
+            'daylight': self._is_daylight,
+            'running': self._running,
+        }
+
+    def async_stop(self):
+        """Stop polling."""
+        self._running = False
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        self._task = None
+        if self._unsub is not None:
+            self._unsub()
+            self._unsub = None
+
+class FetcherMetrics:
+    """Rolling request health of one fetcher, cheap enough to update on every request."""
+
+    __slots__ = ('requests', 'successes', 'errors', 'buckets', 'latency', 'payload_size', 'parse_time', 'last_success', 'pushes',
+                 'recent', 'retries', 'timeout')
+
+    def __init__(self):
+        """Initialize the metrics."""
+        self.requests = 0
+        self.successes = 0
+        self.errors = Counter()
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency = None
+        self.payload_size = None
+        self.parse_time = None
+        self.last_success = None
+        self.pushes = 0
+        self.recent = deque(maxlen=LATENCY_SAMPLES)
+        self.retries = 0
+        self.timeout = None
+
+    def record_response(self, latency, payload_size):
+        """Record the latency and size of a response."""
+        self.latency = latency
+        self.payload_size = payload_size
+        self.buckets[bisect_left(LATENCY_BUCKETS, latency)] += 1
+        self.recent.append(latency)
+
+    def record_timeout(self, timeout):
+        """Record a request that timed out, as taking at least the timeout."""
+        self.recent.append(timeout)
+
+    def record_retry(self):
+        """Record a request retried after a network error."""
+        self.retries += 1
+
+    def record_success(self, now):
+        """Record a successful request."""
+        self._count()
+        self.successes += 1
+        self.last_success = now
+
+    def record_push(self, payload_size, now):
+        """Record data received from the push service."""
+        self.pushes += 1
+        self.payload_size = payload_size
+        self.last_success = now
+
+    def record_error(self, error):
+        """Record a failed request by error type."""
+        self._count()
+        self.errors[error] += 1
+
+    def _count(self):
+        """Count a request, decaying the counters once the window is full."""
+        self.requests += 1
+        if self.requests > METRICS_WINDOW:
+            self.requests //= 2
+            self.successes //= 2
+            self.buckets = [count // 2 for count in self.buckets]
+            self.errors = Counter({error: count // 2 for error, count in self.errors.items() if count > 1})
+
+    @property
+    def latency_ms(self):
+        """Return the latency of the last response in milliseconds."""
+        return None if self.latency is None else round(self.latency * 1000, 1)
 
-    def find_stop_time(self, now):
-        """Return sunset or stop_time if given."""
-        sunset = get_astral_event_date(self.hass, SUN_EVENT_SUNSET, now.date())
-        return sunset
+    @property
+    def parse_time_ms(self):
+        """Return the time spent decoding the last response in milliseconds."""
+        return None if self.parse_time is None else round(self.parse_time * 1000, 3)
+
+    @property
+    def success_rate(self):
+        """Return the percentage of successful requests."""
+        if not self.requests:
+            return None
+        return round(100 * self.successes / self.requests, 1)
+
+    def latency_percentile(self, fraction):
+        """Return a percentile of the latest latencies, or None without enough of them."""
+        if len(self.recent) < MIN_LATENCY_SAMPLES:
+            return None
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def data_age(self, now):
+        """Return the seconds since the last successful request."""
+        if self.last_success is None:
+            return None
+        return round((now - self.last_success).total_seconds())
+
+    def histogram(self):
+        """Return the latency histogram keyed by bucket upper bound."""
+        labels = ['<={}s'.format(bound) for bound in LATENCY_BUCKETS] + ['>{}s'.format(LATENCY_BUCKETS[-1])]
+        return dict(zip(labels, self.buckets))
+
+    def as_dict(self):
+        """Return all metrics for diagnostics."""
+        return {
+            'requests': self.requests,
+            'success_rate': self.success_rate,
+            'errors': dict(self.errors),
+            'latency_ms': self.latency_ms,
+            'latency_histogram': self.histogram(),
+            'payload_bytes': self.payload_size,
+            'parse_time_ms': self.parse_time_ms,
+            'last_success': self.last_success,
+            'pushes': self.pushes,
+            'retries': self.retries,
+            'timeout_s': self.timeout,
+        }
+
+class RequestBudget:
+    """Deadline and retries shared by the requests of one tick."""
+
+    __slots__ = ('deadline', 'retries', 'timeout')
+
+    def __init__(self, deadline, retries, timeout):
+        """Initialize the budget."""
+        self.deadline = deadline
+        self.retries = retries
+        self.timeout = timeout
+
+    def take_retry(self):
+        """Return True and use up one retry if any is left."""
+        if self.retries <= 0:
+            return False
+        self.retries -= 1
+        return True
+
+class EnergyIntegrator:
+    """Extractor integrating a power value of the payloads into the energy of the current day.
+
+    Uses the trapezoidal rule over the time between payloads, restarts at
+    local midnight and does not integrate across gaps longer than max_gap.
+    """
+
+    __slots__ = ('_json_key', '_divisor', '_max_gap', '_energy', '_day', '_last_data', '_last_power', '_last_time')
+
+    def __init__(self, json_key, divisor, max_gap):
+        """Initialize the integrator."""
+        self._json_key = json_key
+        self._divisor = divisor
+        self._max_gap = max_gap
+        self._energy = 0.0
+        self._day = None
+        self._last_data = None
+        self._last_power = None
+        self._last_time = None
+
+    def __call__(self, data):
+        """Integrate the power of a payload and return the energy of the day."""
+        if data is not self._last_data:
+            # the same payload is sampled and then published
+            self._last_data = data
+            self._integrate(data.get(self._json_key), dt_utcnow())
+        return round(self._energy / self._divisor, 2)
+
+    def _integrate(self, power, now):
+        """Add the energy since the previous payload in Wh."""
+        day = as_local(now).date()
+        if day != self._day:
+            self._day = day
+            self._energy = 0.0
+        if power is None:
+            self._last_time = None
+            return
+        if self._last_time is not None and now - self._last_time <= self._max_gap:
+            self._energy += (self._last_power + power) / 2 * (now - self._last_time).total_seconds() / 3600
+        self._last_power = power
+        self._last_time = now
+
+    def restore(self, value, last_updated):
+        """Continue from a restored value if it is from today."""
+        day = as_local(last_updated).date()
+        if day == as_local(dt_utcnow()).date():
+            self._day = day
+            self._energy = value * self._divisor
+
+class SampleWindow:
+    """Fixed-size ring buffer of the samples of one value between two publications."""
+
+    __slots__ = ('_samples', '_count', '_next', '_last')
+
+    def __init__(self, size):
+        """Initialize the window."""
+        self._samples = array('d', bytes(8 * size))
+        self._count = 0
+        self._next = 0
+        self._last = None
+
+    def add(self, value):
+        """Add a sample, overwriting the oldest one once the window is full."""
+        self._samples[self._next] = value
+        self._next = (self._next + 1) % len(self._samples)
+        self._count = min(self._count + 1, len(self._samples))
+        self._last = value
+
+    def __len__(self):
+        """Return the number of samples in the window."""
+        return self._count
+
+    def stats(self):
+        """Return the mean, min, max and last sample."""
+        # the window only wraps around once it is full
+        samples = self._samples if self._count == len(self._samples) else self._samples[:self._count]
+        return {
+            'mean': round(sum(samples) / self._count, 2),
+            'min': min(samples),
+            'max': max(samples),
+            'last': self._last,
+            'samples': self._count,
+        }
+
+    def clear(self):
+        """Start a new window."""
+        self._count = 0
+        self._next = 0
 
 class FroniusFetcher:
     """Handle Fronius API requests."""
 
+    endpoint = 'Endpoint'
+
     def __init__(self, session, ip_address, device_id, scope):
         """Initialize the data object."""
         self._session = session
@@ -365,36 +1464,291 @@ class FroniusFetcher:
         self._device_id = device_id
         self._scope = scope
         self._data = None
+        self._sampled_data = None
+        self._published_data = None
+        self._values = {}
+        self._extractors = {}
+        self._descriptions = {}
+        self._json_keys = set()
+        self._deadbands = {}
+        self._windows = {}
+        self._integrators = set()
+        self._sample_stats = {}
+        self._published = {}
         self._sensors = set()
+        self._diagnostics = set()
+        self.metrics = FetcherMetrics()
+        self._failures = 0
+        self._unreachable = False
+        self._pending = None
+        self._result = None
+        self._fetched_at = None
+        self._pushed_at = None
+        self._request_timeout = DEFAULT_REQUEST_TIMEOUT.total_seconds()
 
-    async def async_update(self):
-        """Retrieve and update latest state."""
+    @property
+    def url(self):
+        """Return the URL requested by this fetcher."""
+        return self._build_url()
+
+    @property
+    def device_id(self):
+        """Return the id of the device requested, None for System scope and the PowerFlow."""
+        return self._device_id
+
+    def serves(self, json_key):
+        """Return True if the responses carry the value of json_key for this device."""
+        return True
+
+    @property
+    def scope(self):
+        """Return the scope of the requests."""
+        return self._scope
+
+    @property
+    def host(self):
+        """Return the address of the Datamanager."""
+        return self._ip_address
+
+    def async_ingest(self, body):
+        """Publish data pushed by the Datamanager.
+
+        The body is parsed like a polled response. Raises ValueError if it
+        is not a valid response for this fetcher.
+        """
+        data = self.parse(body)
+        self._pushed_at = monotonic()
+        self.metrics.record_push(len(body), dt_utcnow())
+        # the Datamanager is evidently reachable again
+        self._failures = 0
+        self._unreachable = False
+        self.async_publish(data)
+
+    def pushed_within(self, period):
+        """Return True if data was pushed within the given period."""
+        return self._pushed_at is not None and monotonic() - self._pushed_at < period.total_seconds()
+
+    async def async_fetch(self, max_age=None, budget=None):
+        """Retrieve the latest data, returning None if the request failed.
+
+        A fetcher shared by several coordinators makes one request for all
+        of them: callers join a request already in flight, and reuse the
+        last result if it is younger than max_age. The request ends by the
+        deadline of the budget and may use one of its retries.
+        """
+        if self._pending is not None:
+            return await asyncio.shield(self._pending)
+        if max_age is not None and self._fetched_at is not None and monotonic() - self._fetched_at < max_age.total_seconds():
+            return self._result
+
+        self._pending = asyncio.ensure_future(self._async_fetch(budget))
+        try:
+            return await asyncio.shield(self._pending)
+        finally:
+            self._pending = None
+
+    def expire(self):
+        """Forget the shared result, so that the next fetch makes a request."""
+        self._fetched_at = None
+
+    async def _async_fetch(self, budget=None):
+        """Retrieve the latest data, returning None if the request failed."""
         try:
-            await self._update()
-        except aiohttp.ClientConnectionError:
-            _LOGGER.error("Failed to update: connection error")
-        except asyncio.TimeoutError:
-            _LOGGER.error("Failed to update: request timeout")
-        except ValueError:
-            _LOGGER.error("Failed to update: invalid response received")
-
-        # Schedule an update for all included sensors
+            result = await self._async_request(budget)
+        finally:
+            self._fetched_at = monotonic()
+        self._result = result
+        return result
+
+    def request_timeout(self, budget=None):
+        """Return the timeout of the next request in seconds.
+
+        This is a multiple of a high percentile of the latest latencies,
+        between a floor and the configured ceiling, and is cut short so the
+        request ends by the deadline of the budget.
+        """
+        ceiling = budget.timeout if budget is not None else DEFAULT_REQUEST_TIMEOUT.total_seconds()
+        timeout = ceiling
+        latency = self.metrics.latency_percentile(TIMEOUT_PERCENTILE)
+        if latency is not None:
+            timeout = min(max(latency * TIMEOUT_FACTOR, TIMEOUT_FLOOR), ceiling)
+        if budget is not None:
+            timeout = min(timeout, budget.deadline - monotonic())
+        return timeout
+
+    async def _async_request(self, budget=None):
+        """Request the endpoint, returning None if the request failed.
+
+        A request failing on the network is retried once, right away, if the
+        budget has a retry left.
+        """
+        retried = False
+        while True:
+            timeout = self.request_timeout(budget)
+            if timeout <= 0:
+                self.metrics.record_error('deadline')
+                self._fetch_failed("no time left before the next poll", True)
+                return None
+            self._request_timeout = self.metrics.timeout = round(timeout, 2)
+
+            try:
+                data = await self._update()
+            except (aiohttp.ClientConnectionError, ConnectionError):
+                error, reason = 'connection', "connection error"
+            except asyncio.TimeoutError:
+                self.metrics.record_timeout(timeout)
+                error, reason = 'timeout', "request timeout"
+            except ValueError:
+                self.metrics.record_error('invalid_response')
+                self._fetch_failed("invalid response received", False)
+                return None
+            else:
+                self.metrics.record_success(dt_utcnow())
+                if self._failures:
+                    _LOGGER.debug("Recovered after %s failed requests", self._failures)
+                self._failures = 0
+                self._unreachable = False
+                return data
+
+            # a retry needs at least the shortest timeout before the deadline
+            if not retried and budget is not None and budget.deadline - monotonic() > RETRY_DELAY + TIMEOUT_FLOOR and budget.take_retry():
+                # the requests are idempotent GETs and register reads
+                retried = True
+                self.metrics.record_retry()
+                _LOGGER.debug("Retrying %s after %s", self.url, reason)
+                await asyncio.sleep(RETRY_DELAY)
+                continue
+
+            self.metrics.record_error(error)
+            self._fetch_failed(reason, True)
+            return None
+
+    def _fetch_failed(self, reason, unreachable):
+        """Record a failed request, logging an error only for the first one in a row."""
+        self._failures += 1
+        self._unreachable = unreachable
+        if self._failures == 1:
+            _LOGGER.error("Failed to update: %s", reason)
+        else:
+            _LOGGER.debug("Failed to update: %s (%s in a row)", reason, self._failures)
+
+    @property
+    def failures(self):
+        """Return the number of failed requests in a row."""
+        return self._failures
+
+    @property
+    def unreachable(self):
+        """Return True if the last request failed with a connection error or timeout."""
+        return self._unreachable
+
+    @property
+    def asleep(self):
+        """Return True if the device reports that it is not producing."""
+        return False
+
+    @property
+    def sampled(self):
+        """Return True if some values are aggregated from samples."""
+        return bool(self._windows)
+
+    def async_sample(self, data):
+        """Add the sampled values of fetched data to their windows, without publishing."""
+        if data is None or data is self._sampled_data:
+            # a result shared with another coordinator is only sampled once
+            return
+        self._data = data
+        self._sampled_data = data
+        for key, window in self._windows.items():
+            value = self._extractors[key](data)
+            if value is not None:
+                window.add(value)
+        # energy counters integrate every sample
+        for key in self._integrators:
+            self._extractors[key](data)
+
+    def async_publish(self, data, force=False):
+        """Store fetched data and schedule an update for the sensors whose value changed."""
+        changed = set()
+        if data is not None and data is not self._published_data:
+            # a result shared with another coordinator is only published once
+            self._published_data = data
+            self.async_sample(data)
+            # convert every monitored condition in a single pass over the payload
+            self._values = {key: extract(data) for key, extract in self._extractors.items()}
+            # sampled values publish the mean of their window
+            for key, window in self._windows.items():
+                if window:
+                    stats = self._sample_stats[key] = window.stats()
+                    self._values[key] = stats['mean']
+                    window.clear()
+            changed = self._changed_keys()
+
+        if force:
+            self._published.update((key, value) for key, value in self._values.items() if value is not None)
+
         for sensor in self._sensors:
+            if force or sensor.data_key in changed:
+                sensor.async_schedule_update_ha_state(True)
+
+        for sensor in self._diagnostics:
             sensor.async_schedule_update_ha_state(True)
 
+    def _changed_keys(self):
+        """Return the keys whose value moved beyond their deadband since last published."""
+        changed = set()
+        for key, value in self._values.items():
+            if value is None:
+                # a missing value keeps the previous state
+                continue
+            last = self._published.get(key)
+            if last is not None:
+                if value == last:
+                    continue
+                deadband = self._deadbands.get(key)
+                if deadband and abs(value - last) < deadband:
+                    continue
+            self._published[key] = value
+            changed.add(key)
+        return changed
+
+    async def async_update(self):
+        """Retrieve and update latest state."""
+        self.async_publish(await self.async_fetch())
+
     async def fetch_data(self, url):
-        """Retrieve data from inverter in async manner."""
+        """Retrieve the raw response body from inverter in async manner."""
         _LOGGER.debug("Requesting data from URL: %s", url)
+        start = monotonic()
         try:
-            response = await self._session.get(url, timeout=10)
-            if response.status != 200:
-                raise ValueError
-            json_response = await response.json()
-            _LOGGER.debug("Got data from URL: %s\n%s", url, json_response)
-            return json_response
+            async with self._session.get(url, timeout=aiohttp.ClientTimeout(total=self._request_timeout)) as response:
+                if response.status != 200:
+                    raise ValueError
+                body = await response.read()
+            self.metrics.record_response(monotonic() - start, len(body))
+            _LOGGER.debug("Got data from URL: %s\n%s", url, body)
+            return body
         except aiohttp.ClientResponseError:
             raise ValueError
 
+    def parse(self, body):
+        """Decode a Solar API response into compact data.
+
+        Only the keys read by the monitored conditions are kept, flattened
+        to their values. Raises ValueError for malformed responses.
+        """
+        start = perf_counter()
+        try:
+            selected = self._select(json_loads(body)['Body']['Data'])
+        except (KeyError, TypeError, AttributeError):
+            raise ValueError
+        self.metrics.parse_time = perf_counter() - start
+        return selected
+
+    def _select(self, data):
+        """Return the values of the monitored keys of the response data."""
+        return {key: data[key] for key in self._json_keys if key in data}
+
     @property
     def latest_data(self):
         """Return the latest data object."""
@@ -402,27 +1756,109 @@ class FroniusFetcher:
             return self._data
         return None
 
+    @property
+    def values(self):
+        """Return the converted values of the latest data keyed by sensor type."""
+        return self._values
+
+    def description(self, key):
+        """Return the SensorDescription of the sensor served under key."""
+        return self._descriptions[key]
+
+    @property
+    def sample_stats(self):
+        """Return the last published window of the sampled values keyed by sensor type."""
+        return self._sample_stats
+
+    def add_extractor(self, key, description, extractor, deadband=0):
+        """Add a compiled extractor to apply to every fetched payload.
+
+        The json_key of the SensorDescription is kept when decoding
+        responses. Changes smaller than deadband from the last published
+        value do not trigger a state write.
+        """
+        self._extractors[key] = extractor
+        self._descriptions[key] = description
+        self._json_keys.add(description.json_key)
+        if deadband:
+            self._deadbands[key] = deadband
+
+    def add_integrator(self, key):
+        """Feed every sample, not only the published ones, to the extractor of key."""
+        self._integrators.add(key)
+
+    def restore_value(self, key, value, last_updated):
+        """Let a stateful extractor continue from a restored sensor state."""
+        extractor = self._extractors.get(key)
+        if hasattr(extractor, 'restore'):
+            extractor.restore(value, last_updated)
+
+    def add_sample_window(self, key, size):
+        """Aggregate the value of an extractor over up to size samples before publishing."""
+        self._windows[key] = SampleWindow(size)
+
     async def register(self, sensor):
         """Register child sensor for update subscriptions."""
         self._sensors.add(sensor)
+        if self._values:
+            # data arrived before the sensor was added
+            sensor.async_schedule_update_ha_state(True)
+
+    def register_diagnostic(self, sensor):
+        """Register a diagnostic sensor updated after every request."""
+        self._diagnostics.add(sensor)
+        if self.metrics.requests:
+            sensor.async_schedule_update_ha_state(True)
 
 class InverterData(FroniusFetcher):
     """Handle Fronius API object and limit updates."""
 
+    endpoint = 'Inverter'
+
     def _build_url(self):
         """Build the URL for the requests."""
-        url = _INVERTERRT_URL.format(self._ip_address, self._scope, self._device_id)
+        if self._scope == 'System':
+            url = _INVERTERRT_SYSTEM_URL.format(self._ip_address)
+        else:
+            url = _INVERTERRT_URL.format(self._ip_address, self._scope, self._device_id)
         _LOGGER.debug("Fronius Inverter URL: %s", url)
         return url
 
     async def _update(self):
         """Get the latest data from inverter."""
         _LOGGER.debug("Requesting inverter data")
-        self._data = (await self.fetch_data(self._build_url()))['Body']['Data']
+        return self.parse(await self.fetch_data(self._build_url()))
+
+    def _select(self, data):
+        """Flatten the monitored values and keep the status code."""
+        if self._scope == 'System':
+            selected = {key: data[key]['Values'] for key in self._json_keys if key in data}
+            if 'PAC' in data:
+                selected.setdefault('PAC', data['PAC']['Values'])
+            return selected
+
+        selected = {key: data[key]['Value'] for key in self._json_keys if key in data}
+        if 'PAC' in data:
+            selected.setdefault('PAC', data['PAC']['Value'])
+        if 'DeviceStatus' in data:
+            selected[STATUS_CODE] = data['DeviceStatus'].get('StatusCode')
+        return selected
+
+    @property
+    def asleep(self):
+        """Return True if the inverter is not feeding in."""
+        if not self._data:
+            return True
+        if STATUS_CODE not in self._data:
+            # System scope has no status, rely on the power being reported
+            return 'PAC' not in self._data
+        return self._data[STATUS_CODE] != INVERTER_STATUS_RUNNING
 
 class PowerflowData(FroniusFetcher):
     """Handle Fronius API object and limit updates."""
 
+    endpoint = 'Powerflow'
+
     def _build_url(self):
         """Build the URL for the requests."""
         url = _POWERFLOW_URL.format(self._ip_address)
@@ -432,18 +1868,105 @@ class PowerflowData(FroniusFetcher):
     async def _update(self):
         """Get the latest data from inverter."""
         _LOGGER.debug("Requesting powerflow data")
-        self._data = (await self.fetch_data(self._build_url()))['Body']['Data']['Site']
+        return self.parse(await self.fetch_data(self._build_url()))
+
+    def _select(self, data):
+        """Return the monitored values of the site, and the energy flows derived from them."""
+        site = data.get('Site')
+        if site is None:
+            raise ValueError
+        selected = super()._select(site)
+        if not self._json_keys.isdisjoint(DERIVED_KEYS):
+            selected.update((key, value) for key, value in _energy_flows(site).items() if key in self._json_keys)
+        return selected
 
 class SmartMeterData(FroniusFetcher):
     """Handle Fronius API object and limit updates."""
 
+    endpoint = 'SmartMeter'
+
     def _build_url(self):
         """Build the URL for the requests."""
-        url = _METER_URL.format(self._ip_address, self._scope, self._device_id)
+        if self._scope == 'System':
+            url = _METER_SYSTEM_URL.format(self._ip_address)
+        else:
+            url = _METER_URL.format(self._ip_address, self._scope, self._device_id)
         _LOGGER.debug("Fronius SmartMeter URL: %s", url)
         return url
 
     async def _update(self):
         """Get the latest data from inverter."""
         _LOGGER.debug("Requesting smartmeter data")
-        self._data = (await self.fetch_data(self._build_url()))['Body']['Data']
+        return self.parse(await self.fetch_data(self._build_url()))
+
+    def _select(self, data):
+        """Return the monitored values of the meter, or of each meter for System scope."""
+        if self._scope == 'System':
+            return {meter_id: super(SmartMeterData, self)._select(meter) for meter_id, meter in data.items()}
+        selected = super()._select(data)
+        if not self._json_keys.isdisjoint(GRID_FLOW_KEYS):
+            grid = next((data[key] for key in METER_POWER_KEYS if key in data), None)
+            selected.update(_grid_flows(grid))
+        return selected
+
+class ModbusInverterData(InverterData):
+    """Read the inverter values from its SunSpec Modbus registers."""
+
+    def _build_url(self):
+        """Build the address of the registers, identifying the fetcher."""
+        return 'modbus://{}/{}'.format(self._session.address, self._device_id)
+
+    _reads_site = False
+
+    def read_site(self):
+        """Also read the site energy registers, which hold the day and year energy of all inverters."""
+        self._reads_site = True
+
+    def serves(self, json_key):
+        """Return True unless json_key is a site value read by another inverter."""
+        return self._reads_site or json_key not in SITE_ENERGY_KEYS
+
+    async def _update(self):
+        """Read the inverter model and, for the site reader, the site energy in a second block read."""
+        _LOGGER.debug("Reading inverter registers")
+        unit = int(self._device_id)
+        start = monotonic()
+        block = await self._session.read_holding_registers(unit, MODEL_ADDRESS, INVERTER_BLOCK_LENGTH, self._request_timeout)
+        site = None
+        # both reads share the request timeout, which ends before the tick deadline
+        remaining = self._request_timeout - (monotonic() - start)
+        if self._reads_site and remaining > 0:
+            try:
+                site = await self._session.read_holding_registers(unit, SITE_ENERGY_ADDRESS, SITE_ENERGY_LENGTH, remaining)
+            except (ConnectionError, asyncio.TimeoutError, ValueError) as error:
+                # the values of the inverter model are still good
+                _LOGGER.debug("Failed to read the site energy: %s", error)
+        self.metrics.record_response(monotonic() - start, 2 * (len(block) + len(site or ())))
+
+        start = perf_counter()
+        values = decode_inverter(block, site)
+        selected = {key: values[key] for key in self._json_keys | {'PAC', STATUS_CODE} if values.get(key) is not None}
+        self.metrics.parse_time = perf_counter() - start
+        return selected
+
+class ModbusSmartMeterData(SmartMeterData):
+    """Read the meter values from its SunSpec Modbus registers."""
+
+    def _build_url(self):
+        """Build the address of the registers, identifying the fetcher."""
+        return 'modbus://{}/{}'.format(self._session.address, METER_UNIT_ID_OFFSET + int(self._device_id))
+
+    async def _update(self):
+        """Read the meter model in one block read."""
+        _LOGGER.debug("Reading smartmeter registers")
+        start = monotonic()
+        block = await self._session.read_holding_registers(METER_UNIT_ID_OFFSET + int(self._device_id), MODEL_ADDRESS, METER_BLOCK_LENGTH, self._request_timeout)
+        self.metrics.record_response(monotonic() - start, 2 * len(block))
+
+        start = perf_counter()
+        values = decode_meter(block)
+        selected = {key: values[key] for key in self._json_keys if values.get(key) is not None}
+        if not self._json_keys.isdisjoint(GRID_FLOW_KEYS):
+            selected.update(_grid_flows(values['PowerReal_P_Sum']))
+        self.metrics.parse_time = perf_counter() - start
+        return selected